@@ -0,0 +1,241 @@
+"""End-to-end turn latency benchmark against the local fake LLM.
+
+Plays scripted adventures of 10, 100 and 1000 turns by typing actions into
+AdventureGame, with the /perf recorder writing each turn's spans: prompt
+build (context window and truncation), LLM wait, reply parsing, console
+display and queueing the autosave. The full save write runs on a background
+thread, so it is timed separately as save_write. --speculate, --stream,
+--redo-alternates and --route turn on the matching game features. Memory
+growth is tracked with tracemalloc. Results are written as JSON; pass a
+previous results file as --baseline to compare.
+
+    python benchmark.py --turns 10 100 1000 --output bench.json
+    python benchmark.py --baseline bench.json --fail-threshold 1.25
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Dict, List, Optional
+
+import fake_llm_server
+from main import CONFIG, LLM_CLIENTS, AdventureGame, PerfRecorder
+
+# In-process stages: the time a turn spends outside the LLM call
+OVERHEAD_STAGES = ["prompt_build", "parse", "display", "autosave", "save_write"]
+# Spans that wait on the LLM; the rest of turn_total is overhead
+LLM_STAGES = ["llm_total", "speculative_wait"]
+
+def _summarize_times(samples: List[float]) -> Dict[str, float]:
+    ordered = sorted(samples)
+    return {
+        "count": len(ordered),
+        "mean_ms": statistics.fmean(ordered) * 1000,
+        "p50_ms": ordered[len(ordered) // 2] * 1000,
+        "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+        "max_ms": ordered[-1] * 1000,
+        "total_ms": sum(ordered) * 1000
+    }
+
+def run_adventure(turns: int, base_url: str, model: str, game_options: dict) -> dict:
+    """Play one scripted adventure through AdventureGame and return its span timings and memory figures"""
+    metrics_path = os.path.abspath(f"turns-{turns}.jsonl")
+    game = AdventureGame(model_name=model, base_url=base_url, perf=PerfRecorder(metrics_path=metrics_path),
+                         **game_options)
+    session = game.session
+    if not session.set_model(model):
+        raise RuntimeError(f"Could not create a client for {model} at {base_url}")
+    if not session.new_game("Fantasy", "Knight", "Bench").ok:
+        raise RuntimeError("The opening scene failed; is the fake server reachable?")
+
+    # The autosave span only covers queueing; the write itself runs on the save thread
+    save_writes: Dict[int, float] = {}
+    tracemalloc.start()
+    memory_start = tracemalloc.get_traced_memory()[0]
+    started_at = time.perf_counter()
+    sink = io.StringIO()
+    for turn in range(turns):
+        options = session.state.last_options
+        action = options[turn % len(options)] if options and turn % 3 else f"I search the area carefully ({turn})"
+        player_turns = session.state.player_turns
+        with contextlib.redirect_stdout(sink):
+            game.process_player_input(action)
+        sink.seek(0)
+        sink.truncate()
+        if session.state.player_turns != player_turns and session._autosave_due():
+            # Let the queued autosave finish, then time a full write of the same snapshot on its own
+            session._autosave.result()
+            t0 = time.perf_counter()
+            session._write_save_data(session._build_save_data())
+            save_writes[game.perf.turns] = time.perf_counter() - t0
+
+    wall = time.perf_counter() - started_at
+    memory_end, memory_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    session.close()
+
+    timings: Dict[str, List[float]] = {}
+    overhead_per_turn: List[float] = []
+    turn_path_per_turn: List[float] = []
+    failures = 0
+    with open(metrics_path, "r", encoding="utf-8") as f:
+        for line in f:
+            record = json.loads(line)
+            spans = {name: ms / 1000 for name, ms in record["spans_ms"].items()}
+            if record["turn"] in save_writes:
+                spans["save_write"] = save_writes[record["turn"]]
+            for name, seconds in spans.items():
+                timings.setdefault(name, []).append(seconds)
+            if not record["ok"]:
+                failures += 1
+                continue
+            # Everything on the turn path except waiting for the model, then plus this turn's save write
+            turn_path = spans.get("turn_total", 0.0) - sum(spans.get(name, 0.0) for name in LLM_STAGES)
+            turn_path_per_turn.append(turn_path)
+            overhead_per_turn.append(turn_path + spans.get("save_write", 0.0))
+
+    tenth = max(1, len(overhead_per_turn) // 10)
+
+    def _tenth_ms(samples: List[float], last: bool) -> float:
+        if not samples:
+            return 0.0
+        return statistics.fmean(samples[-tenth:] if last else samples[:tenth]) * 1000
+
+    return {
+        "turns": turns,
+        "failed_turns": failures,
+        "wall_s": wall,
+        "stages": {stage: _summarize_times(samples) for stage, samples in timings.items() if samples},
+        # Flat per-turn overhead means the first and last tenth of the run cost about the same
+        # overhead_* amortises the background save write over the turns; turn_path_* is what the player waits for
+        "overhead_first_10pct_ms": _tenth_ms(overhead_per_turn, last=False),
+        "overhead_last_10pct_ms": _tenth_ms(overhead_per_turn, last=True),
+        "turn_path_first_10pct_ms": _tenth_ms(turn_path_per_turn, last=False),
+        "turn_path_last_10pct_ms": _tenth_ms(turn_path_per_turn, last=True),
+        "memory": {
+            "growth_kb": (memory_end - memory_start) / 1024,
+            "peak_kb": memory_peak / 1024,
+            "growth_per_turn_kb": (memory_end - memory_start) / 1024 / max(1, turns)
+        }
+    }
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    """Print a comparison table and return the regressions beyond threshold"""
+    regressions = []
+    print(f"\n{'run':>6} {'stage':<14} {'baseline p50':>13} {'current p50':>12} {'ratio':>7}")
+    for turns, run in results["runs"].items():
+        base_run = baseline.get("runs", {}).get(turns)
+        if base_run is None:
+            continue
+        for stage in OVERHEAD_STAGES:
+            current = run["stages"].get(stage)
+            previous = base_run["stages"].get(stage)
+            if not current or not previous:
+                continue
+            ratio = current["p50_ms"] / previous["p50_ms"] if previous["p50_ms"] else 1.0
+            flag = ""
+            if ratio > threshold:
+                flag = "  REGRESSION"
+                regressions.append(f"{turns} turns / {stage}: {ratio:.2f}x")
+            print(f"{turns:>6} {stage:<14} {previous['p50_ms']:>11.3f}ms {current['p50_ms']:>10.3f}ms "
+                  f"{ratio:>6.2f}x{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Turn latency benchmark against the fake LLM server")
+    parser.add_argument("--turns", type=int, nargs="+", default=[10, 100, 1000], help="Adventure lengths to run")
+    parser.add_argument("--model", default=CONFIG["DEFAULT_MODEL"], help="Model name (selects the tokenizer)")
+    parser.add_argument("--base-url", help="Use a running server instead of starting the fake one")
+    parser.add_argument("--ttft", type=float, default=0.0, help="Fake server time to first token (default: 0)")
+    parser.add_argument("--tokens-per-sec", type=float, default=100000.0, help="Fake server speed (default: 100000)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stream", action="store_true", help="Stream replies as the console game does with --stream")
+    parser.add_argument("--speculate", action="store_true", help="Pre-generate replies to the suggested options")
+    parser.add_argument("--redo-alternates", type=int, default=0, help="Prefetch this many /redo alternates")
+    parser.add_argument("--route", action="store_true", help="Route each turn across the configured models")
+    parser.add_argument("--output", default="benchmark_results.json", help="Where to write the JSON results")
+    parser.add_argument("--baseline", help="Earlier results file to compare against")
+    parser.add_argument("--fail-threshold", type=float, default=1.25,
+                        help="Exit non-zero if a stage's p50 exceeds the baseline by this factor (default: 1.25)")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    output_path = os.path.abspath(args.output)
+
+    server = None
+    base_url = args.base_url
+    if not base_url:
+        server = fake_llm_server.start_server(fake_llm_server.FakeLLMConfig(
+            ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, seed=args.seed))
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+    results = {
+        "meta": {
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "model": args.model,
+            "base_url": None if server else base_url,
+            "fake_server": None if not server else {"ttft": args.ttft, "tokens_per_sec": args.tokens_per_sec,
+                                                    "seed": args.seed},
+            "context_token_budget": CONFIG["CONTEXT_TOKEN_BUDGET"],
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S")
+        },
+        "runs": {}
+    }
+
+    game_options = {"stream_output": args.stream, "speculate": args.speculate,
+                    "redo_alternates": args.redo_alternates, "route": args.route}
+    results["meta"]["game_options"] = game_options
+
+    # Saves, logs and error files go to a scratch directory, not the player's adventure.txt
+    workdir = tempfile.TemporaryDirectory(prefix="dungeon-bench-")
+    previous_cwd = os.getcwd()
+    os.chdir(workdir.name)
+    try:
+        for turns in args.turns:
+            print(f"Running {turns} turns...", flush=True)
+            run = run_adventure(turns, base_url, args.model, game_options)
+            results["runs"][str(turns)] = run
+            stages = ", ".join(f"{stage} {timing['p50_ms']:.2f}ms" for stage, timing in run["stages"].items())
+            print(f"  p50: {stages}")
+            print(f"  overhead first/last 10%: {run['overhead_first_10pct_ms']:.2f}/"
+                  f"{run['overhead_last_10pct_ms']:.2f}ms (turn path {run['turn_path_first_10pct_ms']:.2f}/"
+                  f"{run['turn_path_last_10pct_ms']:.2f}ms), memory +{run['memory']['growth_kb']:.0f}KB")
+    finally:
+        os.chdir(previous_cwd)
+        workdir.cleanup()
+        LLM_CLIENTS.close()
+        if server is not None:
+            server.shutdown()
+
+    with open(output_path, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output_path}")
+
+    if baseline is not None:
+        regressions = compare(results, baseline, args.fail_threshold)
+        if regressions:
+            print("Regressions: " + "; ".join(regressions))
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,268 @@
+"""Local OpenAI-compatible stand-in for benchmarking the game offline.
+
+Serves /v1/chat/completions (plain and streaming) and /v1/models with
+schema-valid {"narrative", "options"} replies. Latency, throughput, error
+rate and malformed-reply rate are configurable, as are jitter and occasional
+stalls before the first token (for exercising --hedge), and a fixed seed makes
+runs repeatable. Point the game at it with:
+
+    python fake_llm_server.py --port 8000 --ttft 0.4 --tokens-per-sec 60
+    python main.py --base-url http://127.0.0.1:8000/v1
+"""
+import argparse
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Set, Tuple
+
+SCENE_WORDS = (
+    "lantern shadow corridor whisper ancient door rune ember storm river bridge tower "
+    "merchant guard stranger crowd alley banner forest ruin altar crystal engine signal "
+    "echo footsteps smoke rain chain map key blade mirror"
+).split()
+VERBS = "flickers shifts rumbles glows waits trembles opens fades answers stirs".split()
+OPTIONS = [
+    "Examine the {0} closely", "Follow the {0}", "Call out to the {0}",
+    "Avoid the {0} and move on", "Take the {0} with you", "Wait and watch the {0}"
+]
+
+@dataclass
+class FakeLLMConfig:
+    ttft: float = 0.3
+    tokens_per_sec: float = 50.0
+    error_rate: float = 0.0
+    malformed_rate: float = 0.0
+    reply_words: int = 60
+    seed: int = 0
+    retry_after: float = 1.0
+    ttft_jitter: float = 0.0
+    stall_rate: float = 0.0
+    stall_seconds: float = 5.0
+
+class FakeLLM:
+    """Generates replies and tracks prompt prefixes to report cached tokens"""
+
+    def __init__(self, config: FakeLLMConfig):
+        self.config = config
+        self._rng = random.Random(config.seed)
+        self._lock = threading.Lock()
+        self._seen_prefixes: Set[str] = set()
+        self.requests = 0
+
+    def roll(self) -> Tuple[bool, bool, random.Random]:
+        """Decide (fail, malformed) for a request and hand out its own generator"""
+        with self._lock:
+            self.requests += 1
+            fail = self._rng.random() < self.config.error_rate
+            malformed = self._rng.random() < self.config.malformed_rate
+            return fail, malformed, random.Random(self._rng.random())
+
+    def first_token_delay(self, rng: random.Random) -> float:
+        """ttft plus up to ttft_jitter, with stall_seconds added for a stall_rate share of requests"""
+        delay = self.config.ttft + rng.uniform(0, self.config.ttft_jitter)
+        if rng.random() < self.config.stall_rate:
+            delay += self.config.stall_seconds
+        return delay
+
+    def reply(self, messages: List[dict], rng: random.Random, malformed: bool) -> str:
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        words = [rng.choice(SCENE_WORDS) for _ in range(self.config.reply_words)]
+        sentences = []
+        for start in range(0, len(words), 8):
+            chunk = words[start:start + 8]
+            sentences.append(f"The {' '.join(chunk[:-1])} {rng.choice(VERBS)} near the {chunk[-1]}.")
+        narrative = " ".join(sentences)
+        if '"narrative"' not in str(system):
+            # Summaries and other free-text prompts get plain prose
+            return narrative
+        options = [template.format(rng.choice(SCENE_WORDS)) for template in rng.sample(OPTIONS, 3)]
+        text = json.dumps({"narrative": narrative, "options": options}, ensure_ascii=False)
+        if malformed:
+            # Either truncated JSON or prose with no JSON at all
+            return text[:len(text) // 2] if rng.random() < 0.5 else narrative
+        return text
+
+    def usage(self, messages: List[dict], completion_tokens: int) -> dict:
+        """Token usage with cached_tokens for the longest prompt prefix seen before"""
+        prompt_tokens = 0
+        cached_tokens = 0
+        digest = hashlib.sha256()
+        with self._lock:
+            for message in messages:
+                digest.update(json.dumps(message, sort_keys=True).encode("utf-8"))
+                prompt_tokens += max(1, len(str(message.get("content", ""))) // 4) + 4
+                key = digest.hexdigest()
+                if key in self._seen_prefixes:
+                    cached_tokens = prompt_tokens
+                self._seen_prefixes.add(key)
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+            "prompt_tokens_details": {"cached_tokens": cached_tokens}
+        }
+
+def _tokenize(text: str) -> List[str]:
+    """Split text into word-sized pieces that join back to the original"""
+    pieces: List[str] = []
+    current = ""
+    for ch in text:
+        current += ch
+        if ch == " ":
+            pieces.append(current)
+            current = ""
+    if current:
+        pieces.append(current)
+    return pieces
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    llm: FakeLLM
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: Optional[Dict[str, str]] = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _write_chunk(self, data: bytes) -> None:
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/v1/models":
+            self._send_json(200, {"object": "list", "data": [self._model("fake-model")]})
+        elif self.path.startswith("/v1/models/"):
+            self._send_json(200, self._model(self.path[len("/v1/models/"):]))
+        else:
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+    @staticmethod
+    def _model(model_id: str) -> dict:
+        return {"id": model_id, "object": "model", "created": 0, "owned_by": "fake"}
+
+    def do_POST(self):
+        if self.path.rstrip("/") != "/v1/chat/completions":
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        except (ValueError, json.JSONDecodeError):
+            self._send_json(400, {"error": {"message": "Invalid JSON body", "type": "invalid_request_error"}})
+            return
+
+        config = self.llm.config
+        fail, malformed, rng = self.llm.roll()
+        if fail:
+            self._send_json(503, {"error": {"message": "Simulated overload", "type": "server_error"}},
+                            headers={"Retry-After": str(config.retry_after)})
+            return
+
+        messages = request.get("messages", [])
+        model = request.get("model", "fake-model")
+        delay = self.llm.first_token_delay(rng)
+        replies = [self.llm.reply(messages, rng, malformed) for _ in range(max(1, int(request.get("n") or 1)))]
+        if request.get("stream"):
+            include_usage = bool((request.get("stream_options") or {}).get("include_usage"))
+            self._stream(model, messages, replies[0], include_usage, delay)
+        else:
+            self._complete(model, messages, replies, delay)
+
+    def _complete(self, model: str, messages: List[dict], replies: List[str], delay: float) -> None:
+        config = self.llm.config
+        tokens = sum(len(_tokenize(reply)) for reply in replies)
+        time.sleep(delay + len(_tokenize(replies[0])) / config.tokens_per_sec)
+        self._send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {"index": index, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}
+                for index, reply in enumerate(replies)
+            ],
+            "usage": self.llm.usage(messages, tokens)
+        })
+
+    def _stream(self, model: str, messages: List[dict], reply: str, include_usage: bool, delay: float) -> None:
+        config = self.llm.config
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+
+        def _event(delta: dict, finish_reason: Optional[str] = None, usage: Optional[dict] = None) -> bytes:
+            payload = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                       "choices": [] if usage else [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            if usage:
+                payload["usage"] = usage
+            return f"data: {json.dumps(payload)}\n\n".encode("utf-8")
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        pieces = _tokenize(reply)
+        try:
+            self._write_chunk(_event({"role": "assistant", "content": ""}))
+            time.sleep(delay)
+            for piece in pieces:
+                self._write_chunk(_event({"content": piece}))
+                time.sleep(1 / config.tokens_per_sec)
+            self._write_chunk(_event({}, finish_reason="stop"))
+            if include_usage:
+                self._write_chunk(_event({}, usage=self.llm.usage(messages, len(pieces))))
+            self._write_chunk(b"data: [DONE]\n\n")
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client stopped reading (cancelled speculation or a lost hedge)
+            self.close_connection = True
+
+def start_server(config: FakeLLMConfig, host: str = "127.0.0.1", port: int = 0) -> ThreadingHTTPServer:
+    """Serve in a daemon thread; port 0 picks a free port (see server.server_address)"""
+    handler = type("BoundFakeLLMHandler", (FakeLLMHandler,), {"llm": FakeLLM(config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-llm").start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible fake LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--ttft", type=float, default=0.3, help="Seconds before the first token (default: 0.3)")
+    parser.add_argument("--tokens-per-sec", type=float, default=50.0, help="Streaming speed (default: 50)")
+    parser.add_argument("--ttft-jitter", type=float, default=0.0,
+                        help="Extra random delay before the first token, up to this many seconds (default: 0)")
+    parser.add_argument("--stall-rate", type=float, default=0.0,
+                        help="Fraction of requests that stall before the first token (default: 0)")
+    parser.add_argument("--stall-seconds", type=float, default=5.0, help="Length of a stall (default: 5)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 503")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of replies that are not valid JSON")
+    parser.add_argument("--reply-words", type=int, default=60, help="Narrative length in words (default: 60)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed for repeatable runs")
+    args = parser.parse_args()
+
+    config = FakeLLMConfig(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, error_rate=args.error_rate,
+                           malformed_rate=args.malformed_rate, reply_words=args.reply_words, seed=args.seed,
+                           ttft_jitter=args.ttft_jitter, stall_rate=args.stall_rate, stall_seconds=args.stall_seconds)
+    server = start_server(config, args.host, args.port)
+    print(f"Fake LLM listening on http://{args.host}:{server.server_address[1]}/v1 (Ctrl+C to stop)")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    main()
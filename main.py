@@ -1,29 +1,122 @@
 import argparse
+import asyncio
+import contextlib
+import cProfile
+import io
+import pstats
+import tracemalloc
 import random
 import subprocess
 import os
 import datetime
 import json
+import re
+import time
 import traceback
 import threading
-from typing import List, Optional, Tuple
-from dataclasses import dataclass, field
+import queue
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple, Union
+from dataclasses import asdict, dataclass, field
 
+import httpx
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+import openai
 from langchain_openai import ChatOpenAI
-from langchain_core.messages import HumanMessage, SystemMessage
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
 
 # ===== CONFIGURATION =====
 CONFIG = {
     "LOG_FILE": "error_log.txt",
     "SAVE_FILE": "adventure.txt",
     "DEFAULT_MODEL": "gpt-4.1-mini",
+    # OpenAI-compatible endpoint to use instead of api.openai.com (e.g. fake_llm_server.py)
+    "BASE_URL": None,
     "REQUEST_TIMEOUT": 120,
-    "MAX_CONVERSATION_LENGTH": 10000
+    "CONTEXT_TOKEN_BUDGET": 3000,
+    "MEMORY_TOKEN_BUDGET": 500,
+    "CONTEXT_LOW_WATERMARK": 0.75,
+    "SUMMARY_BATCH_TURNS": 4,
+    "SPECULATIVE_MAX_CONCURRENCY": 4,
+    "SPECULATIVE_MAX_CALLS": 40,
+    "HTTP_MAX_CONNECTIONS": 20,
+    "HTTP_KEEPALIVE_EXPIRY": 90,
+    "CLIENT_IDLE_TTL": 900,
+    "OPENINGS_FILE": "openings.json",
+    "BAKE_CONCURRENCY": 4,
+    "VARIANTS_MAX": 5,
+    "VARIANTS_DEADLINE": 45,
+    "HEDGE_INITIAL_DELAY": 4.0,
+    "HEDGE_MIN_DELAY": 0.5,
+    "HEDGE_PERCENTILE": 0.9,
+    "HEDGE_MIN_SAMPLES": 5,
+    "HEDGE_MAX_PER_MINUTE": 6,
+    "FALLBACK_MODEL": None,
+    "MIN_REQUEST_TIMEOUT": 10,
+    "TIMEOUT_LATENCY_MULTIPLIER": 3.0,
+    "MAX_RETRIES": 2,
+    "RETRY_BACKOFF_BASE": 0.5,
+    "RETRY_BACKOFF_CAP": 8.0,
+    "RETRY_BUDGET_RATIO": 0.2,
+    "RETRY_BUDGET_MIN_PER_MINUTE": 3,
+    "BREAKER_FAILURE_THRESHOLD": 3,
+    "BREAKER_COOLDOWN": 30,
+    # Candidate models for --route, in order of preference
+    "MODEL_ROUTES": [
+        {"name": "gpt-4.1-mini", "quality": 2, "latency_slo": 8.0, "error_slo": 0.2},
+        {"name": "gpt-4.1", "quality": 3, "latency_slo": 15.0, "error_slo": 0.2},
+        {"name": "gpt-4.1-nano", "quality": 1, "latency_slo": 5.0, "error_slo": 0.2}
+    ],
+    "ROUTE_QUALITY_FLOOR": 2,
+    "ROUTE_SLO_WINDOW": 300,
+    "PERF_WINDOW": 200,
+    "PROFILE_DIR": "logs",
+    "PROFILE_TOP": 25,
+    "PROFILE_TRACE_FRAMES": 10,
+    "TTS_QUEUE_SIZE": 2
 }
 
+# A plain prompt string (sent after the system prompt) or a ready-made message list
+PromptInput = Union[str, list]
+
+@dataclass(slots=True)
+class TurnRecord:
+    """One exchange in the turn log; the opening scene has an empty action"""
+    action: str
+    raw_reply: str
+    narrative: str
+    options: List[str] = field(default_factory=list)
+    started_at: float = 0.0
+    finished_at: float = 0.0
+    token_count: int = -1
+    token_encoding: str = ""
+    model: str = ""
+    route_reason: str = ""
+
+    def to_dict(self) -> dict:
+        """Save-file form, without the token count cache (it is recomputed after loading)"""
+        data = asdict(self)
+        del data["token_count"], data["token_encoding"]
+        return data
+
+    def messages(self) -> list:
+        """Chat messages for the prompt history: the action and the narrative only"""
+        reply = AIMessage(content=self.narrative)
+        if not self.action:
+            return [reply]
+        return [HumanMessage(content=self.action), reply]
+
 @dataclass
 class GameState:
-    conversation: str = ""
+    setting: str = ""
+    turns: List[TurnRecord] = field(default_factory=list)
+    player_turns: int = 0
     last_ai_reply: str = ""
     last_ai_reply_raw: str = ""
     last_player_input: str = ""
@@ -33,6 +126,9 @@ class GameState:
     selected_role: str = "Adventurer"
     adventure_started: bool = False
     last_options: list[str] = field(default_factory=list)
+    story_summary: str = ""
+    summarized_turns: int = 0
+    context_start: int = 0
 
 # ===== GAME DATA =====
 ROLE_STARTERS = {
@@ -169,124 +265,2575 @@ ROLE_STARTERS = {
     }
 }
 
-GENRE_DESCRIPTIONS = {
-    "Fantasy": "You are in a world of magic and medieval fantasy, where dragons soar through the skies and ancient ruins hold forgotten treasures.",
-    "Sci-Fi": "You are in the distant future, with advanced technology, space travel, and alien civilizations among the stars.",
-    "Cyberpunk": "You are in a dystopian future dominated by megacorporations, where cybernetic enhancements are common and the line between human and machine is blurred.",
-    "Post-Apocalyptic": "You are in a world after a catastrophic event, where civilization has collapsed and survivors scavenge among the ruins of the old world.",
-    "1880": "You are in the late 19th century during the Industrial Revolution, a time of steam power, early electricity, and social upheaval.",
-    "WW1": "You are in the trenches and battlefields of World War I, a brutal conflict that introduced modern warfare to the world.",
-    "1925 New York": "You are in the Roaring Twenties in New York City, a time of jazz, prohibition, organized crime, and economic prosperity.",
-    "Roman Empire": "You are in ancient Rome at the height of its power, with gladiators, legions, and political intrigue in the eternal city.",
-    "French Revolution": "You are in France during the revolution, a time of upheaval where the monarchy was overthrown and the reign of terror began."
-}
+GENRE_DESCRIPTIONS = {
+    "Fantasy": "You are in a world of magic and medieval fantasy, where dragons soar through the skies and ancient ruins hold forgotten treasures.",
+    "Sci-Fi": "You are in the distant future, with advanced technology, space travel, and alien civilizations among the stars.",
+    "Cyberpunk": "You are in a dystopian future dominated by megacorporations, where cybernetic enhancements are common and the line between human and machine is blurred.",
+    "Post-Apocalyptic": "You are in a world after a catastrophic event, where civilization has collapsed and survivors scavenge among the ruins of the old world.",
+    "1880": "You are in the late 19th century during the Industrial Revolution, a time of steam power, early electricity, and social upheaval.",
+    "WW1": "You are in the trenches and battlefields of World War I, a brutal conflict that introduced modern warfare to the world.",
+    "1925 New York": "You are in the Roaring Twenties in New York City, a time of jazz, prohibition, organized crime, and economic prosperity.",
+    "Roman Empire": "You are in ancient Rome at the height of its power, with gladiators, legions, and political intrigue in the eternal city.",
+    "French Revolution": "You are in France during the revolution, a time of upheaval where the monarchy was overthrown and the reign of terror began."
+}
+
+DM_SYSTEM_PROMPT_EN = """
+You are a masterful Dungeon Master in an unrestricted SFW adventure. Your role is to **always** narrate the consequences of player actions, no matter how extreme, bizarre, violent or unconventional they may be. Follow these rules:
+
+1. ACTION-CONSEQUENCE SYSTEM:
+   - Describe ONLY the consequences of the player's action
+   - Never perform actions on behalf of the player
+   - Consequences must permanently change the game world
+   - Narrate consequences naturally within the story flow
+   - All actions are allowed and must always have some kind of reaction
+
+2. RESPONSE STYLE:
+   - Describe what happens in the world as a result of the player's action
+   - Do not describe the player performing actions - the player has already done that
+   - Never ask "what do you do next" or similar
+   - Always continue the story in a way that feels immersive
+   - Ensure the narrative spans at least five sentences, vividly covering sights, sounds, emotions, and lasting consequences                                                          │
+
+3. WORLD EVOLUTION:
+   - NPCs remember player choices and react accordingly
+   - Environments change permanently based on actions
+   - Player choices open/close future narrative paths
+   - Resources, factions, and the world evolve with every decision
+
+4. PLAYER AGENCY:
+   - The player can attempt **anything**
+   - Never block an action—show the results, good or bad
+   - Let the world react dynamically and permanently
+
+5. OUTPUT FORMAT:
+   - Return your entire reply strictly as a JSON object with the following structure:
+     {"narrative": "...", "options": ["...", "...", "..."]}
+   - "narrative" must describe the consequences of the player's most recent action.
+   - "options" must contain 3 or 4 distinct, concise action suggestions for what the player might do next.
+   - All string values must be written in the same language as the rest of the adventure.
+   - Do not include any additional text outside of the JSON object.
+
+Never break character as the Dungeon Master. Always continue the adventure.
+"""
+
+DM_SYSTEM_PROMPT_ZH = DM_SYSTEM_PROMPT_EN + "\nAll responses must be written entirely in Simplified Chinese.\n"
+
+SUMMARY_SYSTEM_PROMPT = """
+You maintain the long-term memory of a text adventure. Merge the new events into the existing story summary.
+Keep every named NPC, faction, place, item, promise and lasting consequence of the player's choices; drop moment-to-moment detail.
+Write short bullet lines starting with "- ", oldest events first, at most 250 words in total, in the same language as the adventure.
+Return only the bullet lines.
+"""
+
+def _clean_options(raw_options) -> List[str]:
+    """Strip, de-duplicate and cap the suggested actions of a reply"""
+    options: List[str] = []
+    if isinstance(raw_options, list):
+        seen = set()
+        for option in raw_options:
+            if isinstance(option, str):
+                cleaned = option.strip()
+                if cleaned and cleaned not in seen:
+                    options.append(cleaned)
+                    seen.add(cleaned)
+    return options[:4]
+
+class StreamingReplyParser:
+    """Incremental parser for {"narrative": "...", "options": ["..."]} replies.
+
+    feed() accepts raw chunks as they arrive and returns events:
+    ("narrative", delta) for new narrative text and ("option", text) for each
+    suggested action as soon as its string closes. Escapes (including \\u
+    surrogate pairs) may be split across chunk boundaries. Replies that are not
+    a JSON object produce no events; close() then falls back to the raw text.
+    """
+
+    _ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+    def __init__(self):
+        self._chunks: List[str] = []
+        self._started = False
+        self.is_json = True
+        self._stack: List[str] = []
+        self._key: Optional[str] = None
+        self._expect_key = False
+        self._in_string = False
+        self._string_is_key = False
+        self._string_target: Optional[str] = None
+        self._string_chars: List[str] = []
+        self._escape: Optional[str] = None
+        self._high_surrogate: Optional[int] = None
+        self._narrative_started = False
+        self._options: List[str] = []
+
+    def feed(self, chunk: str) -> List[Tuple[str, str]]:
+        if not chunk:
+            return []
+        self._chunks.append(chunk)
+        if not self.is_json:
+            return []
+
+        events: List[Tuple[str, str]] = []
+        narrative_delta: List[str] = []
+        for ch in chunk:
+            if not self._started:
+                if ch.isspace():
+                    continue
+                if ch != "{":
+                    self.is_json = False
+                    return []
+                self._started = True
+            if self._in_string:
+                decoded = self._consume_string_char(ch)
+                if decoded is None:
+                    self._finish_string(events, narrative_delta)
+                elif decoded and self._string_target == "narrative":
+                    if not self._narrative_started:
+                        decoded = decoded.lstrip()
+                        self._narrative_started = bool(decoded)
+                    narrative_delta.append(decoded)
+                elif decoded:
+                    self._string_chars.append(decoded)
+                continue
+            self._consume_structural_char(ch)
+
+        if narrative_delta:
+            events.append(("narrative", "".join(narrative_delta)))
+        return events
+
+    def close(self) -> Tuple[str, List[str]]:
+        """Return the final (narrative, options) parsed from the full reply"""
+        return _parse_reply_text("".join(self._chunks))
+
+    @property
+    def text(self) -> str:
+        return "".join(self._chunks)
+
+    def _consume_structural_char(self, ch: str) -> None:
+        if ch == '"':
+            self._in_string = True
+            self._string_is_key = self._expect_key
+            self._string_chars = []
+            self._string_target = None
+            if not self._string_is_key and len(self._stack) == 1 and self._key == "narrative":
+                self._string_target = "narrative"
+            elif not self._string_is_key and self._stack == ["{", "["] and self._key == "options":
+                self._string_target = "option"
+        elif ch == "{":
+            self._stack.append("{")
+            self._expect_key = True
+        elif ch == "[":
+            self._stack.append("[")
+            self._expect_key = False
+        elif ch in "}]":
+            if self._stack:
+                self._stack.pop()
+            self._expect_key = False
+        elif ch == ",":
+            self._expect_key = bool(self._stack) and self._stack[-1] == "{"
+        elif ch == ":":
+            self._expect_key = False
+
+    def _consume_string_char(self, ch: str) -> Optional[str]:
+        """Decode one character inside a string; None marks the closing quote"""
+        if self._escape is not None:
+            self._escape += ch
+            if self._escape[0] != "u":
+                code = self._escape
+                self._escape = None
+                return self._emit_codepoint(self._ESCAPES.get(code, code))
+            if len(self._escape) < 5:
+                return ""
+            hex_digits = self._escape[1:]
+            self._escape = None
+            try:
+                value = int(hex_digits, 16)
+            except ValueError:
+                return ""
+            if 0xD800 <= value <= 0xDBFF:
+                self._high_surrogate = value
+                return ""
+            if 0xDC00 <= value <= 0xDFFF:
+                high = self._high_surrogate
+                self._high_surrogate = None
+                if high is None:
+                    return ""
+                return chr(0x10000 + ((high - 0xD800) << 10) + (value - 0xDC00))
+            return self._emit_codepoint(chr(value))
+        if ch == "\\":
+            self._escape = ""
+            return ""
+        if ch == '"':
+            return None
+        return self._emit_codepoint(ch)
+
+    def _emit_codepoint(self, text: str) -> str:
+        # A lone high surrogate cannot be rendered; drop it rather than emit garbage
+        self._high_surrogate = None
+        return text
+
+    def _finish_string(self, events: List[Tuple[str, str]], narrative_delta: List[str]) -> None:
+        self._in_string = False
+        value = "".join(self._string_chars)
+        if self._string_is_key:
+            self._key = value if len(self._stack) == 1 else self._key
+            self._expect_key = False
+        elif self._string_target == "option":
+            cleaned = value.strip()
+            if cleaned and cleaned not in self._options and len(self._options) < 4:
+                self._options.append(cleaned)
+                if narrative_delta:
+                    events.append(("narrative", "".join(narrative_delta)))
+                    narrative_delta.clear()
+                events.append(("option", cleaned))
+        self._string_chars = []
+        self._string_target = None
+
+def _replay_events(ai_reply: str, on_event: Optional[Callable[[str, str], None]]) -> None:
+    """Send a reply that arrived whole (baked, speculative, prefetched) to on_event as if it had streamed"""
+    if ai_reply and on_event is not None:
+        for kind, text in StreamingReplyParser().feed(ai_reply):
+            on_event(kind, text)
+
+def _parse_reply_text(ai_reply: str) -> Tuple[str, List[str]]:
+    """Parse a complete reply into (narrative, options), falling back to raw text"""
+    reply_text = ai_reply.strip()
+    if not reply_text:
+        return "", []
+
+    try:
+        data = json.loads(reply_text)
+        if isinstance(data, dict):
+            narrative = str(data.get("narrative", "")).strip()
+            return narrative, _clean_options(data.get("options", []))
+    except json.JSONDecodeError:
+        pass
+
+    return reply_text, []
+
+_CJK_RANGES = (
+    (0x3040, 0x30FF),   # Hiragana, Katakana
+    (0x3400, 0x4DBF),   # CJK Extension A
+    (0x4E00, 0x9FFF),   # CJK Unified Ideographs
+    (0xAC00, 0xD7AF),   # Hangul
+    (0xF900, 0xFAFF),   # CJK Compatibility Ideographs
+    (0xFF00, 0xFFEF),   # Full-width forms
+)
+
+def _is_cjk(ch: str) -> bool:
+    code = ord(ch)
+    return any(low <= code <= high for low, high in _CJK_RANGES)
+
+class TokenCounter:
+    """Counts tokens per model with tiktoken, or estimates them when it is unavailable"""
+
+    FALLBACK_ENCODING = "o200k_base"
+
+    def __init__(self):
+        self._encodings = {}
+
+    def encoding_name(self, model_name: str) -> str:
+        encoding = self._get_encoding(model_name)
+        return encoding.name if encoding is not None else "estimate"
+
+    def count(self, text: str, model_name: str) -> int:
+        if not text:
+            return 0
+        encoding = self._get_encoding(model_name)
+        if encoding is not None:
+            return len(encoding.encode(text, disallowed_special=()))
+        # Roughly one token per CJK character and per four characters otherwise
+        cjk = sum(1 for ch in text if _is_cjk(ch))
+        return cjk + (len(text) - cjk + 3) // 4
+
+    def _get_encoding(self, model_name: str):
+        if tiktoken is None:
+            return None
+        if model_name not in self._encodings:
+            try:
+                try:
+                    encoding = tiktoken.encoding_for_model(model_name)
+                except KeyError:
+                    encoding = tiktoken.get_encoding(self.FALLBACK_ENCODING)
+            except Exception:
+                # Encodings are downloaded on first use; estimate when offline
+                encoding = None
+            self._encodings[model_name] = encoding
+        return self._encodings[model_name]
+
+@dataclass
+class PromptContext:
+    messages: list
+    tokens: int
+    first_turn: int
+
+@dataclass
+class PromptCacheStats:
+    """Prompt-cache hits reported by the provider in the response usage metadata"""
+    requests: int = 0
+    prompt_tokens: int = 0
+    cached_tokens: int = 0
+    last_prompt_tokens: int = 0
+    last_cached_tokens: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def record(self, message) -> None:
+        usage = getattr(message, "usage_metadata", None) or {}
+        if not usage:
+            return
+        prompt_tokens = usage.get("input_tokens", 0) or 0
+        cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+        self.requests += 1
+        self.prompt_tokens += prompt_tokens
+        self.cached_tokens += cached_tokens
+        self.last_prompt_tokens = prompt_tokens
+        self.last_cached_tokens = cached_tokens
+
+@dataclass
+class UsageTotals:
+    calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    cached_tokens: int = 0
+    seconds: float = 0.0
+
+    @property
+    def tokens_per_sec(self) -> float:
+        return self.completion_tokens / self.seconds if self.seconds else 0.0
+
+    def add(self, prompt_tokens: int, completion_tokens: int, cached_tokens: int, seconds: float) -> None:
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.completion_tokens += completion_tokens
+        self.cached_tokens += cached_tokens
+        self.seconds += seconds
+
+class UsageLedger:
+    """Token usage from response metadata, totalled per call kind and per model.
+
+    Kinds name the feature that made the call: turn, redo, opening, summary,
+    speculative and variants. Calls whose response carried no usage metadata
+    are not counted.
+    """
+
+    def __init__(self):
+        self.total = UsageTotals()
+        self.by_kind: Dict[str, UsageTotals] = {}
+        self.by_model: Dict[str, UsageTotals] = {}
+        self._lock = threading.Lock()
+
+    def record(self, kind: str, model_name: str, message, seconds: float) -> None:
+        usage = getattr(message, "usage_metadata", None) or {}
+        if not usage:
+            return
+        counts = (
+            usage.get("input_tokens", 0) or 0,
+            usage.get("output_tokens", 0) or 0,
+            (usage.get("input_token_details") or {}).get("cache_read", 0) or 0,
+            seconds
+        )
+        with self._lock:
+            self.total.add(*counts)
+            self.by_kind.setdefault(kind, UsageTotals()).add(*counts)
+            self.by_model.setdefault(model_name, UsageTotals()).add(*counts)
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            return {
+                "total": asdict(self.total),
+                "by_kind": {kind: asdict(totals) for kind, totals in self.by_kind.items()},
+                "by_model": {model: asdict(totals) for model, totals in self.by_model.items()}
+            }
+
+    def load(self, data: dict) -> None:
+        """Replace the totals with those from to_dict(), e.g. when a save is loaded"""
+        with self._lock:
+            self.total = UsageTotals(**data.get("total", {}))
+            self.by_kind = {kind: UsageTotals(**totals) for kind, totals in data.get("by_kind", {}).items()}
+            self.by_model = {model: UsageTotals(**totals) for model, totals in data.get("by_model", {}).items()}
+
+class _PerfSpan:
+    __slots__ = ("recorder", "name", "started_at")
+
+    def __init__(self, recorder: "PerfRecorder", name: str):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.record(self.name, time.perf_counter() - self.started_at)
+        return False
+
+class PerfRecorder:
+    """Rolling per-stage timings for the /perf report.
+
+    Spans keep the last `window` samples per stage, and each finished turn can
+    be appended to a JSONL metrics file. While disabled, span() hands back a
+    shared no-op context manager and record() returns immediately.
+    """
+
+    BUCKETS = [0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0]
+    _DISABLED_SPAN = contextlib.nullcontext()
+
+    def __init__(self, enabled: bool = False, metrics_path: Optional[str] = None,
+                 window: int = CONFIG["PERF_WINDOW"]):
+        self.enabled = enabled or bool(metrics_path)
+        self.metrics_path = metrics_path
+        self.window = window
+        self.samples: Dict[str, deque] = {}
+        self.turns = 0
+        self._turn: Optional[Dict[str, float]] = None
+        self._lock = threading.Lock()
+
+    def span(self, name: str):
+        if not self.enabled:
+            return self._DISABLED_SPAN
+        return _PerfSpan(self, name)
+
+    def record(self, name: str, seconds: float) -> None:
+        if not self.enabled:
+            return
+        with self._lock:
+            self.samples.setdefault(name, deque(maxlen=self.window)).append(seconds)
+            if self._turn is not None:
+                self._turn[name] = self._turn.get(name, 0.0) + seconds
+
+    def begin_turn(self) -> None:
+        if self.enabled:
+            self._turn = {}
+
+    def end_turn(self, **fields) -> None:
+        """Close the current turn and append it to the metrics file, if any"""
+        if not self.enabled or self._turn is None:
+            return
+        with self._lock:
+            spans, self._turn = self._turn, None
+            self.turns += 1
+        if not self.metrics_path:
+            return
+        line = {"ts": time.time(), "turn": self.turns,
+                "spans_ms": {name: round(seconds * 1000, 3) for name, seconds in spans.items()}}
+        line.update(fields)
+        try:
+            with open(self.metrics_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(line, ensure_ascii=False) + "\n")
+        except OSError:
+            # Metrics are best-effort; never fail a turn over them
+            self.metrics_path = None
+
+    def report(self) -> str:
+        """Percentiles and a latency histogram for every recorded stage"""
+        with self._lock:
+            snapshot = {name: sorted(values) for name, values in self.samples.items() if values}
+        if not snapshot:
+            return "No timings recorded yet."
+
+        def _pct(values: List[float], fraction: float) -> float:
+            return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+        labels = [f"<{int(b * 1000)}ms" if b < 1 else f"<{b:g}s" for b in self.BUCKETS] + [f">={self.BUCKETS[-1]:g}s"]
+        lines = [f"{'stage':<14}{'n':>5}{'p50':>10}{'p90':>10}{'p99':>10}{'max':>10}"]
+        for name, values in snapshot.items():
+            lines.append(f"{name:<14}{len(values):>5}{_pct(values, 0.5):>8.2f}ms{_pct(values, 0.9):>8.2f}ms"
+                         f"{_pct(values, 0.99):>8.2f}ms{values[-1] * 1000:>8.2f}ms")
+        for name, values in snapshot.items():
+            counts = [0] * (len(self.BUCKETS) + 1)
+            for value in values:
+                counts[next((i for i, bound in enumerate(self.BUCKETS) if value < bound), len(self.BUCKETS))] += 1
+            peak = max(counts)
+            lines.append(f"\n{name}:")
+            for label, count in zip(labels, counts):
+                if count:
+                    lines.append(f"  {label:>8} {'#' * max(1, round(20 * count / peak))} {count}")
+        return "\n".join(lines)
+
+class SessionProfiler:
+    """cProfile and tracemalloc capture for a running game, written to logs/.
+
+    While active, every finished turn appends its hottest functions and its
+    largest allocation changes to a per-session report. stop() adds the
+    totals and a .pstats dump for snakeviz or pstats. Only the main thread
+    is profiled; background LLM calls show up as time spent waiting.
+    """
+
+    def __init__(self, directory: str = CONFIG["PROFILE_DIR"], top: int = CONFIG["PROFILE_TOP"]):
+        self.directory = directory
+        self.top = top
+        self.report_path: Optional[str] = None
+        self._profile: Optional[cProfile.Profile] = None
+        self._total: Optional[pstats.Stats] = None
+        self._first_snapshot = None
+        self._last_snapshot = None
+        self._started_tracing = False
+        self._turns = 0
+
+    @property
+    def active(self) -> bool:
+        return self._profile is not None
+
+    def start(self) -> str:
+        """Begin profiling and return the report path"""
+        if self.active:
+            return self.report_path
+        os.makedirs(self.directory, exist_ok=True)
+        stamp = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+        self.report_path = os.path.join(self.directory, f"profile-{stamp}.txt")
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(CONFIG["PROFILE_TRACE_FRAMES"])
+            self._started_tracing = True
+        self._first_snapshot = self._last_snapshot = tracemalloc.take_snapshot()
+        self._total = None
+        self._turns = 0
+        self._write(f"Profile started {datetime.datetime.now().isoformat()}\n")
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+        return self.report_path
+
+    def turn_finished(self, label: str) -> None:
+        """Write the hot functions and allocation changes since the previous turn"""
+        if not self.active:
+            return
+        self._profile.disable()
+        self._turns += 1
+        snapshot = tracemalloc.take_snapshot()
+        self._write(
+            f"\n===== Turn {self._turns}: {label[:60]} =====\n"
+            + self._format_stats(pstats.Stats(self._profile))
+            + self._format_allocations(snapshot, self._last_snapshot)
+        )
+        self._collect(self._profile)
+        self._last_snapshot = snapshot
+        self._profile = cProfile.Profile()
+        self._profile.enable()
+
+    def stop(self) -> Optional[str]:
+        """Stop profiling, write the session totals and return the .pstats path"""
+        if not self.active:
+            return None
+        self._profile.disable()
+        self._collect(self._profile)
+        self._profile = None
+        snapshot = tracemalloc.take_snapshot()
+
+        stats_path = os.path.splitext(self.report_path)[0] + ".pstats"
+        self._total.dump_stats(stats_path)
+        self._write(
+            f"\n===== Session total ({self._turns} turns) =====\n"
+            + self._format_stats(self._total)
+            + self._format_allocations(snapshot, self._first_snapshot)
+        )
+        self._first_snapshot = self._last_snapshot = None
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return stats_path
+
+    def _collect(self, profile: cProfile.Profile) -> None:
+        if self._total is None:
+            self._total = pstats.Stats(profile)
+        else:
+            self._total.add(profile)
+
+    def _format_stats(self, stats: pstats.Stats) -> str:
+        buffer = io.StringIO()
+        stats.stream = buffer
+        stats.sort_stats("cumulative").print_stats(self.top)
+        return buffer.getvalue()
+
+    def _format_allocations(self, snapshot, previous) -> str:
+        lines = ["Top allocation changes:"]
+        for stat in snapshot.compare_to(previous, "lineno")[:self.top]:
+            lines.append(f"  {stat}")
+        current, peak = tracemalloc.get_traced_memory()
+        lines.append(f"Traced memory: {current / 1024:.0f} KiB now, {peak / 1024:.0f} KiB peak\n")
+        return "\n".join(lines)
+
+    def _write(self, text: str) -> None:
+        with open(self.report_path, "a", encoding="utf-8") as f:
+            f.write(text)
+
+class ContextBuilder:
+    """Builds token-budgeted chat prompts with a stable, cacheable prefix.
+
+    The message list is: system prompt, the adventure setting, an optional
+    memory message, then alternating player/Dungeon Master messages for the
+    newest whole turns. The system prompt and setting are byte-identical on
+    every turn. When the history outgrows the budget, old turns are evicted
+    down to a low watermark rather than one at a time, so the start of the
+    history also stays put for several turns and provider prefix caching hits.
+    Token counts are cached on each TurnRecord and for the prefix, so
+    rebuilding only counts new turns.
+    """
+
+    SETTING_NOTE = (
+        "The player's actions follow as user messages and your earlier narration as assistant messages. "
+        "Always reply with the JSON object.\n"
+    )
+    TRUNCATION_NOTE = "[Earlier conversation truncated...]"
+    # Approximate per-message framing overhead in the chat format
+    MESSAGE_OVERHEAD = 4
+    # Bumped whenever the turn encoding changes so cached token counts are recomputed
+    HISTORY_FORMAT = "messages"
+
+    def __init__(self, counter: Optional[TokenCounter] = None,
+                 total_budget: int = CONFIG["CONTEXT_TOKEN_BUDGET"],
+                 memory_budget: int = CONFIG["MEMORY_TOKEN_BUDGET"],
+                 low_watermark: float = CONFIG["CONTEXT_LOW_WATERMARK"]):
+        self.counter = counter or TokenCounter()
+        self.total_budget = total_budget
+        self.memory_budget = memory_budget
+        self.low_watermark = low_watermark
+        # (encoding, system prompt, setting) -> tokens; the prefix is identical on every turn
+        self._prefix_tokens: Tuple[tuple, int] = ((), 0)
+
+    def prefix_tokens(self, messages: list, model_name: str) -> int:
+        """Token count of the system prompt and setting messages, cached while they are unchanged"""
+        key = (self.counter.encoding_name(model_name), *(message.content for message in messages))
+        cached_key, tokens = self._prefix_tokens
+        if cached_key != key:
+            tokens = sum(self.counter.count(m.content, model_name) + self.MESSAGE_OVERHEAD for m in messages)
+            self._prefix_tokens = (key, tokens)
+        return tokens
+
+    def turn_tokens(self, turn: TurnRecord, model_name: str) -> int:
+        encoding = f"{self.counter.encoding_name(model_name)}/{self.HISTORY_FORMAT}"
+        if turn.token_count < 0 or turn.token_encoding != encoding:
+            turn.token_count = sum(
+                self.counter.count(message.content, model_name) + self.MESSAGE_OVERHEAD
+                for message in turn.messages()
+            )
+            turn.token_encoding = encoding
+        return turn.token_count
+
+    def fit_memory(self, memory: str, model_name: str) -> str:
+        """Keep the newest memory lines that fit in the memory budget"""
+        if not memory or self.counter.count(memory, model_name) <= self.memory_budget:
+            return memory
+        kept: List[str] = []
+        used = 0
+        for line in reversed(memory.splitlines()):
+            cost = self.counter.count(line + "\n", model_name)
+            if used + cost > self.memory_budget:
+                break
+            kept.append(line)
+            used += cost
+        return "\n".join(reversed(kept))
+
+    def build(self, state: GameState, model_name: str, system_prompt: str,
+              pending_action: Optional[str] = None, memory: str = "") -> PromptContext:
+        messages = [SystemMessage(content=system_prompt), HumanMessage(content=state.setting + self.SETTING_NOTE)]
+        used = self.prefix_tokens(messages, model_name)
+        memory = self.fit_memory(memory, model_name)
+        memory_parts = [f"### Story So Far ###\n{memory}"] if memory else []
+        # Reserve room for the truncation note so adding it never overflows the budget
+        used += self.counter.count("\n\n".join(memory_parts + [self.TRUNCATION_NOTE]), model_name) + self.MESSAGE_OVERHEAD
+        if pending_action is not None:
+            used += self.counter.count(pending_action, model_name) + self.MESSAGE_OVERHEAD
+        first_turn, used = self._fill_turns(state, model_name, used)
+
+        if first_turn > 0:
+            memory_parts.append(self.TRUNCATION_NOTE)
+        if memory_parts:
+            messages.append(HumanMessage(content="\n\n".join(memory_parts)))
+        for turn in state.turns[first_turn:]:
+            messages.extend(turn.messages())
+        if pending_action is not None:
+            messages.append(HumanMessage(content=pending_action))
+        return PromptContext(messages=messages, tokens=used, first_turn=first_turn)
+
+    def _fill_turns(self, state: GameState, model_name: str, used: int) -> Tuple[int, int]:
+        """Pick the oldest turn to keep, moving the window start only when over budget"""
+        count = len(state.turns)
+        first_turn = min(state.context_start, max(count - 1, 0))
+        window = sum(self.turn_tokens(turn, model_name) for turn in state.turns[first_turn:])
+        if used + window > self.total_budget:
+            target = int(self.total_budget * self.low_watermark)
+            # Always keep the newest turn so the model sees what it just said
+            while first_turn < count - 1 and used + window > target:
+                window -= self.turn_tokens(state.turns[first_turn], model_name)
+                first_turn += 1
+        state.context_start = first_turn
+        return first_turn, used + window
+
+class LLMClientRegistry:
+    """Process-wide cache of ChatOpenAI clients sharing one keep-alive connection pool.
+
+    Clients are keyed by model name and constructor parameters, so switching
+    between models (or loading a save) reuses an existing client and its warm
+    TLS connections. Clients unused for idle_ttl seconds are dropped on the
+    next lookup. Safe to share across sessions and threads.
+    """
+
+    def __init__(self, idle_ttl: float = CONFIG["CLIENT_IDLE_TTL"]):
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._clients: Dict[tuple, Tuple[ChatOpenAI, float]] = {}
+        self._http_client: Optional[httpx.Client] = None
+
+    @property
+    def http_client(self) -> httpx.Client:
+        with self._lock:
+            return self._get_http_client()
+
+    def get(self, model_name: str, **params) -> ChatOpenAI:
+        key = (model_name, tuple(sorted(params.items())))
+        now = time.monotonic()
+        with self._lock:
+            self._evict_idle(now)
+            entry = self._clients.get(key)
+            if entry is not None:
+                client = entry[0]
+            else:
+                client = ChatOpenAI(model=model_name, http_client=self._get_http_client(), **params)
+            self._clients[key] = (client, now)
+            return client
+
+    def close(self) -> None:
+        with self._lock:
+            self._clients.clear()
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+
+    def _get_http_client(self) -> httpx.Client:
+        if self._http_client is None:
+            self._http_client = httpx.Client(
+                limits=httpx.Limits(
+                    max_connections=CONFIG["HTTP_MAX_CONNECTIONS"],
+                    max_keepalive_connections=CONFIG["HTTP_MAX_CONNECTIONS"],
+                    keepalive_expiry=CONFIG["HTTP_KEEPALIVE_EXPIRY"]
+                )
+            )
+        return self._http_client
+
+    def _evict_idle(self, now: float) -> None:
+        expired = [key for key, (_, last_used) in self._clients.items() if now - last_used > self.idle_ttl]
+        for key in expired:
+            del self._clients[key]
+
+LLM_CLIENTS = LLMClientRegistry()
+
+@dataclass
+class SpeculationStats:
+    launched: int = 0
+    hits: int = 0
+    misses: int = 0
+    cancelled: int = 0
+    latency_saved: float = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        decided = self.hits + self.misses
+        return self.hits / decided if decided else 0.0
+
+class StreamCancelled(Exception):
+    """Raised inside a stream that was abandoned on purpose, so it is not recorded as a call"""
+
+def _stream_until_cancelled(llm: ChatOpenAI, messages: list, cancel_event: threading.Event, **kwargs) -> Iterator:
+    """Yield llm.stream() chunks, raising StreamCancelled once cancel_event is set"""
+    for chunk in llm.stream(messages, **kwargs):
+        # Leaving the stream early closes the connection and stops generation
+        if cancel_event.is_set():
+            raise StreamCancelled()
+        yield chunk
+
+@dataclass
+class _Speculation:
+    action: str
+    cancel_event: threading.Event = field(default_factory=threading.Event)
+    future: Optional[Future] = None
+    started_at: float = 0.0
+    finished_at: float = 0.0
+
+class SpeculativeGenerator:
+    """Pre-generates replies for the suggested options while the player reads.
+
+    At most max_concurrency generations run at once and at most max_calls are
+    launched per session. take() hands over the reply for the chosen action
+    and cancels every other generation.
+    """
+
+    def __init__(self, max_concurrency: int = CONFIG["SPECULATIVE_MAX_CONCURRENCY"],
+                 max_calls: int = CONFIG["SPECULATIVE_MAX_CALLS"],
+                 on_error: Optional[Callable[[str, Exception], None]] = None,
+                 on_usage: Optional[Callable[[ChatOpenAI, object, float], None]] = None,
+                 run: Optional[Callable[[ChatOpenAI, Callable[[ChatOpenAI, float], str], Callable[[], bool]], str]] = None):
+        self.max_concurrency = max_concurrency
+        self.max_calls = max_calls
+        self.on_error = on_error
+        self.on_usage = on_usage
+        # run(llm, call, can_retry) executes call(client, timeout), e.g. through LLMResilience.run
+        self.run = run or (lambda llm, call, can_retry: call(llm, CONFIG["REQUEST_TIMEOUT"]))
+        self.stats = SpeculationStats()
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix="speculate")
+        self._pending: Dict[str, _Speculation] = {}
+
+    @property
+    def remaining_calls(self) -> int:
+        return max(0, self.max_calls - self.stats.launched)
+
+    def start(self, llm: ChatOpenAI, jobs: List[Tuple[str, list]]) -> None:
+        """Launch one generation per (action, messages) pair, within the spend cap"""
+        self.cancel_all()
+        for action, messages in jobs[:self.max_concurrency]:
+            if not self.remaining_calls:
+                break
+            spec = _Speculation(action=action)
+            spec.future = self._executor.submit(self._generate, llm, messages, spec)
+            self._pending[action] = spec
+            self.stats.launched += 1
+
+    def take(self, action: str) -> Optional[str]:
+        """Return the pre-generated reply for action, waiting if it is still running"""
+        if not self._pending:
+            return None
+        spec = self._pending.pop(action, None)
+        self.cancel_all()
+        if spec is None:
+            self.stats.misses += 1
+            return None
+
+        taken_at = time.perf_counter()
+        reply = spec.future.result()
+        if not reply:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        self.stats.latency_saved += max(0.0, min(taken_at, spec.finished_at) - spec.started_at)
+        return reply
+
+    def cancel_all(self) -> None:
+        for spec in self._pending.values():
+            spec.cancel_event.set()
+            if spec.future.cancel():
+                # Never reached the provider, so it does not count against the cap
+                self.stats.launched -= 1
+            self.stats.cancelled += 1
+        self._pending.clear()
+
+    def shutdown(self) -> None:
+        self.cancel_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _generate(self, llm: ChatOpenAI, messages: list, spec: _Speculation) -> str:
+        spec.started_at = time.perf_counter()
+
+        def _stream(client: ChatOpenAI, timeout: float) -> str:
+            chunks: List[str] = []
+            for chunk in _stream_until_cancelled(client, messages, spec.cancel_event, timeout=timeout):
+                if self.on_usage and getattr(chunk, "usage_metadata", None):
+                    self.on_usage(client, chunk, time.perf_counter() - spec.started_at)
+                content = getattr(chunk, "content", "")
+                if isinstance(content, str):
+                    chunks.append(content)
+            return "".join(chunks).strip()
+
+        try:
+            return self.run(llm, _stream, lambda: not spec.cancel_event.is_set())
+        except Exception as e:
+            if self.on_error and not spec.cancel_event.is_set():
+                self.on_error("Error in speculative generation", e)
+            return ""
+        finally:
+            spec.finished_at = time.perf_counter()
+
+@dataclass
+class HedgeStats:
+    requests: int = 0
+    hedged: int = 0
+    hedge_wins: int = 0
+    capped: int = 0
+
+class HedgedStreamer:
+    """Streams a reply, racing a duplicate request when the first token is late.
+
+    The hedge fires once the primary request has gone without a first token for
+    longer than the observed time-to-first-token percentile (a fixed delay until
+    enough samples exist). Whichever request produces content first wins and the
+    other is abandoned. At most max_per_minute hedges are sent.
+    """
+
+    def __init__(self, percentile: float = CONFIG["HEDGE_PERCENTILE"],
+                 initial_delay: float = CONFIG["HEDGE_INITIAL_DELAY"],
+                 min_delay: float = CONFIG["HEDGE_MIN_DELAY"],
+                 max_per_minute: int = CONFIG["HEDGE_MAX_PER_MINUTE"],
+                 window: int = 50):
+        self.percentile = percentile
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_per_minute = max_per_minute
+        self.stats = HedgeStats()
+        self._ttft: deque = deque(maxlen=window)
+        self._hedge_times: deque = deque()
+        self._lock = threading.Lock()
+
+    def delay(self) -> float:
+        """Seconds to wait for a first token before hedging"""
+        with self._lock:
+            samples = sorted(self._ttft)
+        if len(samples) < CONFIG["HEDGE_MIN_SAMPLES"]:
+            return self.initial_delay
+        index = min(len(samples) - 1, int(len(samples) * self.percentile))
+        return max(self.min_delay, samples[index])
+
+    def record_ttft(self, seconds: float) -> None:
+        with self._lock:
+            self._ttft.append(seconds)
+
+    def _acquire_hedge(self) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            while self._hedge_times and now - self._hedge_times[0] > 60:
+                self._hedge_times.popleft()
+            if len(self._hedge_times) >= self.max_per_minute:
+                return False
+            self._hedge_times.append(now)
+            return True
+
+    def stream(self, llm: ChatOpenAI, messages: list, **kwargs) -> Iterator:
+        """Yield the chunks of whichever request produces content first"""
+        self.stats.requests += 1
+        events: "queue.Queue[Tuple[int, str, object]]" = queue.Queue()
+        cancel_events: List[threading.Event] = []
+
+        def _launch() -> int:
+            attempt = len(cancel_events)
+            cancel_event = threading.Event()
+            cancel_events.append(cancel_event)
+            threading.Thread(target=self._pump, args=(llm, messages, kwargs, attempt, cancel_event, events),
+                             daemon=True, name=f"hedge-{attempt}").start()
+            return attempt
+
+        started_at = time.monotonic()
+        _launch()
+        hedge_decided = False
+        winner: Optional[int] = None
+        failures = 0
+        buffered: Dict[int, list] = {}
+        try:
+            while True:
+                timeout = None
+                if not hedge_decided:
+                    timeout = max(0.0, started_at + self.delay() - time.monotonic())
+                try:
+                    attempt, kind, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    hedge_decided = True
+                    if self._acquire_hedge():
+                        self.stats.hedged += 1
+                        _launch()
+                    else:
+                        self.stats.capped += 1
+                    continue
+
+                if winner is not None and attempt != winner:
+                    continue
+                if kind == "error":
+                    failures += 1
+                    if winner is not None or failures >= len(cancel_events):
+                        raise payload
+                    continue
+                if winner is None:
+                    content = getattr(payload, "content", "")
+                    if kind == "chunk" and not (isinstance(content, str) and content):
+                        # Role and usage chunks do not count as a first token
+                        buffered.setdefault(attempt, []).append(payload)
+                        continue
+                    winner = attempt
+                    hedge_decided = True
+                    self.record_ttft(time.monotonic() - started_at)
+                    if attempt:
+                        self.stats.hedge_wins += 1
+                    for other, cancel_event in enumerate(cancel_events):
+                        if other != attempt:
+                            cancel_event.set()
+                    yield from buffered.pop(attempt, [])
+                if kind == "done":
+                    return
+                yield payload
+        finally:
+            for cancel_event in cancel_events:
+                cancel_event.set()
+
+    @staticmethod
+    def _pump(llm: ChatOpenAI, messages: list, kwargs: dict, attempt: int, cancel_event: threading.Event,
+              events: "queue.Queue[Tuple[int, str, object]]") -> None:
+        try:
+            for chunk in _stream_until_cancelled(llm, messages, cancel_event, **kwargs):
+                events.put((attempt, "chunk", chunk))
+            events.put((attempt, "done", None))
+        except StreamCancelled:
+            return
+        except Exception as e:
+            events.put((attempt, "error", e))
+
+class CircuitOpenError(RuntimeError):
+    """Raised when every candidate model's circuit breaker is open"""
+
+@dataclass
+class ModelHealth:
+    latencies: deque = field(default_factory=lambda: deque(maxlen=50))
+    # (time, latency) per call, latency None for failures; feeds the router's SLO checks
+    recent: deque = field(default_factory=lambda: deque(maxlen=50))
+    requests: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    state: str = "closed"
+    opened_at: float = 0.0
+
+class LLMResilience:
+    """Timeouts, retries and circuit breaking shared by every LLM call.
+
+    Each model gets a timeout derived from its recent latency (p95 times a
+    multiplier, clamped between MIN_REQUEST_TIMEOUT and REQUEST_TIMEOUT).
+    Transient errors are retried with full-jitter backoff, or after the
+    provider's Retry-After, as long as the global retry budget allows.
+    After BREAKER_FAILURE_THRESHOLD consecutive failures a model's breaker
+    opens: calls skip it, going to the fallback model or failing fast, until
+    a trial call after BREAKER_COOLDOWN succeeds.
+    """
+
+    RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+    def __init__(self, client_factory: Callable[[str], ChatOpenAI],
+                 fallback_model: Optional[str] = CONFIG["FALLBACK_MODEL"],
+                 on_error: Optional[Callable[[str, Exception], None]] = None):
+        self.client_factory = client_factory
+        self.fallback_model = fallback_model
+        # Per-turn fallback picked by the router, tried before fallback_model
+        self.route_fallback: Optional[str] = None
+        self.on_error = on_error
+        self.health: Dict[str, ModelHealth] = {}
+        self.retries = 0
+        self.fallbacks = 0
+        self._request_times: deque = deque()
+        self._retry_times: deque = deque()
+        self._lock = threading.Lock()
+        self._served = threading.local()
+
+    def _health(self, model_name: str) -> ModelHealth:
+        with self._lock:
+            return self.health.setdefault(model_name, ModelHealth())
+
+    def served_by(self) -> Optional[str]:
+        """The model serving this thread's current call, or the one that answered its last successful call"""
+        return getattr(self._served, "model", None)
+
+    def timeout_for(self, model_name: str) -> float:
+        health = self._health(model_name)
+        samples = sorted(health.latencies)
+        if len(samples) < 5:
+            return CONFIG["REQUEST_TIMEOUT"]
+        p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+        return min(CONFIG["REQUEST_TIMEOUT"],
+                   max(CONFIG["MIN_REQUEST_TIMEOUT"], p95 * CONFIG["TIMEOUT_LATENCY_MULTIPLIER"]))
+
+    def available(self, model_name: str) -> bool:
+        """Whether the breaker lets a call through, moving it to half-open after the cooldown"""
+        health = self._health(model_name)
+        with self._lock:
+            if health.state == "open":
+                if time.monotonic() - health.opened_at < CONFIG["BREAKER_COOLDOWN"]:
+                    return False
+                health.state = "half-open"
+            return True
+
+    def record_success(self, model_name: str, latency: float) -> None:
+        health = self._health(model_name)
+        with self._lock:
+            health.requests += 1
+            health.latencies.append(latency)
+            health.recent.append((time.monotonic(), latency))
+            health.consecutive_failures = 0
+            health.state = "closed"
+
+    def record_failure(self, model_name: str) -> None:
+        health = self._health(model_name)
+        with self._lock:
+            health.requests += 1
+            health.failures += 1
+            health.recent.append((time.monotonic(), None))
+            health.consecutive_failures += 1
+            if health.state == "half-open" or health.consecutive_failures >= CONFIG["BREAKER_FAILURE_THRESHOLD"]:
+                health.state = "open"
+                health.opened_at = time.monotonic()
+
+    def is_retryable(self, error: Exception) -> bool:
+        if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+            return True
+        return getattr(error, "status_code", None) in self.RETRYABLE_STATUS
+
+    def backoff(self, attempt: int, error: Exception) -> Optional[float]:
+        """Seconds to wait before retry `attempt`, preferring the provider's Retry-After.
+
+        Returns None when Retry-After asks for longer than RETRY_BACKOFF_CAP:
+        retrying sooner would ignore the provider, so the caller moves on.
+        """
+        response = getattr(error, "response", None)
+        headers = getattr(response, "headers", None) or {}
+        retry_after = None
+        try:
+            if headers.get("retry-after-ms"):
+                retry_after = float(headers["retry-after-ms"]) / 1000
+            elif headers.get("retry-after"):
+                retry_after = float(headers["retry-after"])
+        except ValueError:
+            pass
+        if retry_after is not None:
+            return retry_after if retry_after <= CONFIG["RETRY_BACKOFF_CAP"] else None
+        return random.uniform(0, min(CONFIG["RETRY_BACKOFF_CAP"], CONFIG["RETRY_BACKOFF_BASE"] * 2 ** attempt))
+
+    def _note_request(self) -> None:
+        with self._lock:
+            self._request_times.append(time.monotonic())
+
+    def _acquire_retry(self) -> bool:
+        """Spend from the retry budget: a fraction of recent requests, with a small floor"""
+        now = time.monotonic()
+        with self._lock:
+            for times in (self._request_times, self._retry_times):
+                while times and now - times[0] > 60:
+                    times.popleft()
+            budget = max(CONFIG["RETRY_BUDGET_MIN_PER_MINUTE"],
+                         int(len(self._request_times) * CONFIG["RETRY_BUDGET_RATIO"]))
+            if len(self._retry_times) >= budget:
+                return False
+            self._retry_times.append(now)
+            self.retries += 1
+            return True
+
+    def _candidates(self, model_name: str, llm: ChatOpenAI) -> Iterator[Tuple[str, ChatOpenAI]]:
+        """Yield the models to try in order, skipping any whose breaker is open"""
+        candidates = [(model_name, llm)]
+        for fallback in (self.route_fallback, self.fallback_model):
+            if fallback and all(fallback != name for name, _ in candidates):
+                candidates.append((fallback, None))
+        for index, (name, client) in enumerate(candidates):
+            if not self.available(name):
+                continue
+            if index:
+                self.fallbacks += 1
+            yield name, client if client is not None else self.client_factory(name)
+
+    def _retry_delay(self, name: str, attempt: int, error: Exception, can_retry: Callable[[], bool]) -> Optional[float]:
+        """Record a failed attempt and return the backoff before retrying, or None to move on"""
+        if not self.is_retryable(error) or not can_retry():
+            # Bad requests and half-delivered streams are not the provider's fault
+            raise error
+        self.record_failure(name)
+        if attempt >= CONFIG["MAX_RETRIES"] or not self.available(name):
+            return None
+        delay = self.backoff(attempt, error)
+        if delay is None or not self._acquire_retry():
+            return None
+        if self.on_error:
+            self.on_error(f"Retrying request to '{name}'", error)
+        return delay
+
+    def run(self, model_name: str, llm: ChatOpenAI, call: Callable[[ChatOpenAI, float], object],
+            can_retry: Callable[[], bool] = lambda: True):
+        """Run call(llm, timeout) against the model, retrying and falling back as allowed"""
+        self._served.model = None
+        last_error: Exception = CircuitOpenError(f"Model '{model_name}' is unavailable")
+        for name, client in self._candidates(model_name, llm):
+            attempt = 0
+            while True:
+                self._note_request()
+                started_at = time.monotonic()
+                # Set before calling so usage recorded inside a stream goes to the model serving it
+                self._served.model = name
+                try:
+                    result = call(client, self.timeout_for(name))
+                except Exception as e:
+                    last_error = e
+                    delay = self._retry_delay(name, attempt, e, can_retry)
+                    if delay is None:
+                        break
+                    time.sleep(delay)
+                    attempt += 1
+                    continue
+                self.record_success(name, time.monotonic() - started_at)
+                return result
+        self._served.model = None
+        raise last_error
+
+    async def arun(self, model_name: str, llm: ChatOpenAI, call: Callable[[ChatOpenAI, float], Awaitable],
+                   can_retry: Callable[[], bool] = lambda: True):
+        """Async counterpart of run for calls that return awaitables"""
+        self._served.model = None
+        last_error: Exception = CircuitOpenError(f"Model '{model_name}' is unavailable")
+        for name, client in self._candidates(model_name, llm):
+            attempt = 0
+            while True:
+                self._note_request()
+                started_at = time.monotonic()
+                self._served.model = name
+                try:
+                    result = await call(client, self.timeout_for(name))
+                except Exception as e:
+                    last_error = e
+                    delay = self._retry_delay(name, attempt, e, can_retry)
+                    if delay is None:
+                        break
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self.record_success(name, time.monotonic() - started_at)
+                return result
+        self._served.model = None
+        raise last_error
+
+    async def astream(self, model_name: str, llm: ChatOpenAI,
+                      open_stream: Callable[[ChatOpenAI, float], AsyncIterator]) -> AsyncIterator:
+        """Yield chunks from open_stream(llm, timeout); retries only until content has been yielded"""
+        self._served.model = None
+        last_error: Exception = CircuitOpenError(f"Model '{model_name}' is unavailable")
+        for name, client in self._candidates(model_name, llm):
+            attempt = 0
+            while True:
+                self._note_request()
+                started_at = time.monotonic()
+                delivered = False
+                self._served.model = name
+                try:
+                    async for chunk in open_stream(client, self.timeout_for(name)):
+                        delivered = delivered or bool(getattr(chunk, "content", ""))
+                        yield chunk
+                except Exception as e:
+                    last_error = e
+                    delay = self._retry_delay(name, attempt, e, lambda: not delivered)
+                    if delay is None:
+                        break
+                    await asyncio.sleep(delay)
+                    attempt += 1
+                    continue
+                self.record_success(name, time.monotonic() - started_at)
+                return
+        self._served.model = None
+        raise last_error
+
+@dataclass
+class ModelRoute:
+    name: str
+    quality: int = 1
+    latency_slo: float = CONFIG["REQUEST_TIMEOUT"]
+    error_slo: float = 1.0
+
+class ModelRouter:
+    """Sends each turn to the fastest healthy model that meets the quality floor.
+
+    A model is healthy when its breaker is closed, its recent error rate is
+    within error_slo and its p90 latency is within latency_slo, both measured
+    over the last ROUTE_SLO_WINDOW seconds. Models without
+    latency samples are tried first, in list order, so each gets measured.
+    choose() also names the next healthy model as the fallback for the turn.
+    """
+
+    def __init__(self, routes: List[ModelRoute], resilience: LLMResilience,
+                 quality_floor: int = CONFIG["ROUTE_QUALITY_FLOOR"]):
+        self.routes = routes
+        self.resilience = resilience
+        self.quality_floor = quality_floor
+
+    @classmethod
+    def from_config(cls, resilience: LLMResilience, quality_floor: int = CONFIG["ROUTE_QUALITY_FLOOR"]) -> "ModelRouter":
+        return cls([ModelRoute(**route) for route in CONFIG["MODEL_ROUTES"]], resilience, quality_floor)
+
+    def _breach(self, route: ModelRoute) -> Optional[str]:
+        """Describe why the model is unhealthy, or None if it meets its SLOs"""
+        if not self.resilience.available(route.name):
+            return "circuit open"
+        outcomes = self._recent(route.name)
+        if outcomes:
+            error_rate = sum(latency is None for latency in outcomes) / len(outcomes)
+            if error_rate > route.error_slo:
+                return f"error rate {error_rate:.0%} over {route.error_slo:.0%}"
+        latencies = sorted(latency for latency in outcomes if latency is not None)
+        if latencies:
+            p90 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.9))]
+            if p90 > route.latency_slo:
+                return f"p90 {p90:.1f}s over {route.latency_slo:.1f}s"
+        return None
+
+    def _recent(self, model_name: str) -> List[Optional[float]]:
+        """Latencies (None for failures) within the SLO window; older calls are forgiven"""
+        health = self.resilience.health.get(model_name)
+        if health is None:
+            return []
+        cutoff = time.monotonic() - CONFIG["ROUTE_SLO_WINDOW"]
+        return [latency for at, latency in list(health.recent) if at >= cutoff]
+
+    def choose(self) -> Tuple[str, Optional[str], str]:
+        """Return (model, fallback model, reason) for the next turn"""
+        eligible = [route for route in self.routes if route.quality >= self.quality_floor]
+        if not eligible:
+            eligible = sorted(self.routes, key=lambda route: -route.quality)[:1]
+        breaches = {route.name: self._breach(route) for route in eligible}
+        healthy = [route for route in eligible if breaches[route.name] is None]
+        if not healthy:
+            # Nothing meets its SLOs: take the first model whose breaker still admits calls
+            for route in eligible:
+                if breaches[route.name] != "circuit open":
+                    return route.name, None, f"no model within SLO; {route.name}: {breaches[route.name]}"
+            return eligible[0].name, None, "all models degraded"
+
+        def _speed(indexed: Tuple[int, ModelRoute]) -> Tuple[float, int]:
+            index, route = indexed
+            samples = sorted(latency for latency in self._recent(route.name) if latency is not None)
+            # Unmeasured models go first so every candidate gets measured
+            median = samples[len(samples) // 2] if samples else 0.0
+            return median, index
+
+        ranked = [route for _, route in sorted(enumerate(healthy), key=_speed)]
+        chosen = ranked[0]
+        fallback = ranked[1].name if len(ranked) > 1 else None
+        skipped = [f"{name}: {breach}" for name, breach in breaches.items() if breach]
+        reason = "fastest healthy" + (f" ({'; '.join(skipped)})" if skipped else "")
+        return chosen.name, fallback, reason
+
+class OpeningBundle:
+    """Pre-generated opening scenes keyed by language, genre and role.
+
+    Baked offline with `main.py --bake-openings`. Each stored reply uses
+    NAME_PLACEHOLDER wherever the character's name appears.
+    """
+
+    NAME_PLACEHOLDER = "{{NAME}}"
+
+    def __init__(self, path: str = CONFIG["OPENINGS_FILE"]):
+        self.path = path
+        self.openings: Dict[str, Dict[str, Dict[str, List[str]]]] = {}
+
+    @classmethod
+    def load(cls, path: str = CONFIG["OPENINGS_FILE"]) -> "OpeningBundle":
+        bundle = cls(path)
+        if os.path.exists(path):
+            with open(path, "r", encoding="utf-8") as f:
+                bundle.openings = json.load(f).get("openings", {})
+        return bundle
+
+    def save(self) -> None:
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"placeholder": self.NAME_PLACEHOLDER, "openings": self.openings}, f, indent=2, ensure_ascii=False)
+
+    def add(self, language: str, genre: str, role: str, raw_reply: str) -> None:
+        self.openings.setdefault(language, {}).setdefault(genre, {}).setdefault(role, []).append(raw_reply)
+
+    def clear(self, language: str) -> None:
+        self.openings.pop(language, None)
+
+    def count(self, language: Optional[str] = None) -> int:
+        languages = [language] if language else list(self.openings)
+        return sum(
+            len(replies)
+            for lang in languages
+            for roles in self.openings.get(lang, {}).values()
+            for replies in roles.values()
+        )
+
+    def sample(self, language: str, genre: str, role: str, name: str) -> Optional[str]:
+        """Return a random baked opening with the character's name filled in"""
+        replies = list(self.openings.get(language, {}).get(genre, {}).get(role, []))
+        random.shuffle(replies)
+        for raw_reply in replies:
+            personalized = self.personalize(raw_reply, name)
+            if personalized:
+                return personalized
+        return None
+
+    @classmethod
+    def personalize(cls, raw_reply: str, name: str) -> Optional[str]:
+        """Fill the character's name into a placeholder reply.
+
+        Returns None when the name already occurs as a whole word in the
+        narrative or options (for example an NPC with the same name), since
+        substituting it would change the story.
+        """
+        name = name.strip()
+        if name:
+            narrative, options = _parse_reply_text(raw_reply)
+            pattern = re.compile(rf"(?<!\w){re.escape(name)}(?!\w)", re.IGNORECASE)
+            if any(pattern.search(text) for text in [narrative, *options]):
+                return None
+        # The reply is raw JSON, so the name must be inserted JSON-escaped
+        escaped_name = json.dumps(name, ensure_ascii=False)[1:-1]
+        return raw_reply.replace(cls.NAME_PLACEHOLDER, escaped_name)
+
+    @classmethod
+    def has_mangled_placeholder(cls, text: str) -> bool:
+        """True if the model rewrote the placeholder instead of copying it verbatim"""
+        leftover = text.replace(cls.NAME_PLACEHOLDER, "")
+        return re.search(r"\{\{|\}\}|[\[{<]\s*name\s*[\]}>]", leftover, re.IGNORECASE) is not None
+
+@dataclass
+class TurnResult:
+    """Outcome of an engine call, free of any console I/O"""
+    ok: bool
+    narrative: str = ""
+    options: List[str] = field(default_factory=list)
+    raw_reply: str = ""
+    action: str = ""
+    error: str = ""
+    autosaved: bool = False
+    autosave_failed: bool = False
+
+def _get_starter(genre: str, role: str) -> str:
+    return ROLE_STARTERS.get(genre, {}).get(
+        role,
+        "You find yourself in an unexpected situation when"
+    )
+
+class AdventureSession:
+    """Headless game engine: state, prompts and LLM calls without input() or print().
+
+    Every game action returns a TurnResult so the engine can be driven from the
+    CLI, a server, a test harness or a batch job. Passing on_event to an action
+    streams the reply and forwards StreamingReplyParser events as they arrive.
+    """
+
+    def __init__(self, use_chinese: bool = False, model_name: Optional[str] = None, speculate: bool = False,
+                 openings: Optional[OpeningBundle] = None, redo_alternates: int = 0, hedge: bool = False,
+                 fallback_model: Optional[str] = CONFIG["FALLBACK_MODEL"], route: bool = False,
+                 base_url: Optional[str] = CONFIG["BASE_URL"], perf: Optional[PerfRecorder] = None):
+        self.state = GameState()
+        self.base_url = base_url
+        self.perf = perf or PerfRecorder()
+        self.usage = UsageLedger()
+        self._usage_local = threading.local()
+        self.llm: Optional[ChatOpenAI] = None
+        self.use_chinese = use_chinese
+        self.system_prompt = DM_SYSTEM_PROMPT_ZH if use_chinese else DM_SYSTEM_PROMPT_EN
+        self._background_tasks: Set[asyncio.Task] = set()
+        self.context = ContextBuilder()
+        self.prompt_cache = PromptCacheStats()
+        self._summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="summary")
+        # One writer keeps saves in order; serialising the turn log happens there, off the turn path
+        self._save_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="save")
+        self._save_sequence = 0
+        self._autosave: Optional[Future] = None
+        self._summary_lock = threading.Lock()
+        self._summary_pending = False
+        self._story_generation = 0
+        self.speculator = SpeculativeGenerator(
+            on_error=self.log_error, on_usage=self._record_speculative_usage,
+            run=lambda llm, call, can_retry: self.resilience.run(self.state.current_model, llm, call, can_retry)
+        ) if speculate else None
+        self.openings = openings
+        self._pending_opening: Optional[Tuple[str, str, str, Future]] = None
+        self.redo_alternates = redo_alternates
+        self._alternates_executor: Optional[ThreadPoolExecutor] = None
+        self._alternates_key_value: Optional[tuple] = None
+        self._alternates_future: Optional[Future] = None
+        self._alternates: List[str] = []
+        self._variants_executor: Optional[ThreadPoolExecutor] = None
+        self.hedger = HedgedStreamer() if hedge else None
+        self.resilience = LLMResilience(self._create_llm, fallback_model=fallback_model, on_error=self.log_error)
+        self.router = ModelRouter.from_config(self.resilience) if route else None
+        self._turn_route: Tuple[str, str] = ("", "")
+        if model_name:
+            self.state.current_model = model_name
+
+    def log_error(self, error_message: str, exception: Optional[Exception] = None) -> None:
+        """Enhanced error logging with rotation"""
+        try:
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            log_path = CONFIG["LOG_FILE"]
+            
+            with open(log_path, "a", encoding="utf-8") as log_file:
+                log_file.write(f"\n--- ERROR [{timestamp}] ---\n")
+                log_file.write(f"Message: {error_message}\n")
+                
+                if exception:
+                    log_file.write(f"Exception: {type(exception).__name__}: {str(exception)}\n")
+                    traceback.print_exc(file=log_file)
+                
+                log_file.write(f"Game State: Model={self.state.current_model}, ")
+                log_file.write(f"Genre={self.state.selected_genre}, Role={self.state.selected_role}\n")
+                log_file.write("--- END ERROR ---\n")
+                
+        except Exception as e:
+            print(f"CRITICAL: Failed to write to error log: {e}")
+
+    def _create_llm(self, model_name: str) -> ChatOpenAI:
+        endpoint = {}
+        if self.base_url:
+            # Local OpenAI-compatible servers ignore the key, but the client insists on one
+            endpoint = {"base_url": self.base_url, "api_key": os.getenv("OPENAI_API_KEY") or "local"}
+        return LLM_CLIENTS.get(
+            model_name,
+            **endpoint,
+            temperature=0.7,
+            timeout=CONFIG["REQUEST_TIMEOUT"],
+            # Retries are handled by LLMResilience so they share one budget
+            max_retries=0,
+            stream_usage=True,
+        )
+
+    def set_model(self, model_name: str) -> bool:
+        self._cancel_speculation()
+        self._clear_alternates()
+        try:
+            self.llm = self._create_llm(model_name)
+            self.state.current_model = model_name
+            return True
+        except Exception as e:
+            self.log_error(f"Failed to initialize model '{model_name}'", e)
+            return False
+
+    def prewarm(self) -> threading.Thread:
+        """Load the tokenizer and open the provider connection in the background.
+
+        Started as soon as the model is known so DNS, TLS and first-request
+        overhead are paid while the player is still answering menu prompts.
+        """
+        llm = self.llm
+        model_name = self.state.current_model
+
+        def _warm():
+            try:
+                self.context.counter.encoding_name(model_name)
+                if llm is not None:
+                    llm.root_client.with_options(timeout=10, max_retries=0).models.retrieve(model_name)
+            except Exception as e:
+                self.log_error("Connection warm-up failed", e)
+
+        thread = threading.Thread(target=_warm, daemon=True, name="prewarm")
+        thread.start()
+        return thread
+
+    @contextlib.contextmanager
+    def _usage_kind(self, kind: str):
+        """Attribute the token usage of calls made in this block (on this thread) to kind"""
+        previous = getattr(self._usage_local, "kind", None)
+        self._usage_local.kind = kind
+        try:
+            yield
+        finally:
+            self._usage_local.kind = previous
+
+    def _record_usage(self, message, started_at: float, kind: Optional[str] = None) -> None:
+        self.usage.record(
+            kind or getattr(self._usage_local, "kind", None) or "turn",
+            self.resilience.served_by() or self.state.current_model,
+            message, time.perf_counter() - started_at
+        )
+
+    def _record_speculative_usage(self, llm: ChatOpenAI, message, seconds: float) -> None:
+        self.usage.record("speculative", getattr(llm, "model_name", self.state.current_model), message, seconds)
+
+    def get_ai_response(self, prompt: PromptInput) -> str:
+        """Get AI response with enhanced error handling and prompt optimization"""
+        try:
+            if not self.llm and not self.set_model(self.state.current_model):
+                return ""
+
+            messages = self._build_messages(prompt)
+            started_at = time.perf_counter()
+            response = self.resilience.run(
+                self.state.current_model, self.llm,
+                lambda llm, timeout: llm.invoke(messages, timeout=timeout)
+            )
+            self.prompt_cache.record(response)
+            self._record_usage(response, started_at)
+            ai_text = getattr(response, "content", str(response))
+            return ai_text.strip()
+
+        except Exception as e:
+            return self._handle_ai_error("Error getting AI response", e)
+
+    def _build_messages(self, prompt: PromptInput) -> list:
+        if not isinstance(prompt, str):
+            return prompt
+        return [
+            SystemMessage(content=self.system_prompt.strip()),
+            HumanMessage(content=prompt)
+        ]
+
+    def _handle_ai_error(self, error_message: str, exception: Exception) -> str:
+        """Log a failed AI request and return the fallback reply text"""
+        if isinstance(exception, CircuitOpenError):
+            self.log_error("AI request skipped: circuit breaker open", exception)
+            return ""
+        if "timeout" in str(exception).lower():
+            self.log_error("AI request timed out", exception)
+            return "The world seems to pause as if time has stopped. What would you like to do?"
+        self.log_error(error_message, exception)
+        return ""
+
+    def stream_ai_response(self, prompt: PromptInput, on_event: Callable[[str, str], None]) -> str:
+        """Stream the AI response, passing parser events to on_event as they arrive"""
+        try:
+            if not self.llm and not self.set_model(self.state.current_model):
+                return ""
+
+            messages = self._build_messages(prompt)
+            parser = StreamingReplyParser()
+            started_at = time.perf_counter()
+
+            def _stream(llm: ChatOpenAI, timeout: float) -> str:
+                nonlocal parser
+                parser = StreamingReplyParser()
+                if self.hedger:
+                    chunks = self.hedger.stream(llm, messages, timeout=timeout)
+                else:
+                    chunks = llm.stream(messages, timeout=timeout)
+                for chunk in chunks:
+                    self.prompt_cache.record(chunk)
+                    # Only the final chunk carries usage metadata
+                    self._record_usage(chunk, started_at)
+                    content = getattr(chunk, "content", "")
+                    if not isinstance(content, str) or not content:
+                        continue
+                    for kind, text in parser.feed(content):
+                        on_event(kind, text)
+                return parser.text.strip()
+
+            # Once text has reached the player a retry would repeat it
+            return self.resilience.run(self.state.current_model, self.llm, _stream,
+                                       can_retry=lambda: not parser.text)
+
+        except Exception as e:
+            return self._handle_ai_error("Error streaming AI response", e)
+
+    def _request_reply(self, prompt: PromptInput, on_event: Optional[Callable[[str, str], None]]) -> str:
+        reason = self._route_turn()
+        if on_event is not None and self.perf.enabled:
+            on_event = self._time_first_event(on_event)
+        with self.perf.span("llm_total"):
+            if on_event is None and self.hedger is None:
+                ai_reply = self.get_ai_response(prompt)
+            else:
+                # Hedging needs the time to first token, so it always goes through the stream
+                ai_reply = self.stream_ai_response(prompt, on_event or (lambda kind, text: None))
+        self._note_turn_route(reason, ai_reply)
+        return ai_reply
+
+    def _note_turn_route(self, reason: str, ai_reply: str) -> None:
+        """Remember which model actually served the turn, for the turn log"""
+        served_by = self.resilience.served_by() or self.state.current_model
+        if served_by != self.state.current_model:
+            reason = f"fallback from {self.state.current_model}" + (f"; {reason}" if reason else "")
+        self._turn_route = (served_by, reason) if ai_reply else ("", "")
+
+    def _time_first_event(self, on_event: Callable[[str, str], None]) -> Callable[[str, str], None]:
+        """Wrap on_event so the first parser event records the time to first token"""
+        started_at = time.perf_counter()
+        first = True
+
+        def _on_event(kind: str, text: str) -> None:
+            nonlocal first
+            if first:
+                first = False
+                self.perf.record("llm_ttft", time.perf_counter() - started_at)
+            on_event(kind, text)
+        return _on_event
+
+    def _route_turn(self) -> str:
+        """Point the session at the router's pick for this turn and return the reason"""
+        if self.router is None:
+            return ""
+        model_name, fallback, reason = self.router.choose()
+        self.resilience.route_fallback = fallback
+        if model_name != self.state.current_model or not self.llm:
+            if not self.set_model(model_name):
+                return f"kept {self.state.current_model}; {model_name} unavailable"
+        return reason
+
+    async def aget_ai_response(self, prompt: PromptInput) -> str:
+        """Async counterpart of get_ai_response built on ainvoke"""
+        try:
+            if not self.llm and not self.set_model(self.state.current_model):
+                return ""
+
+            messages = self._build_messages(prompt)
+            started_at = time.perf_counter()
+            response = await self.resilience.arun(
+                self.state.current_model, self.llm,
+                lambda llm, timeout: llm.ainvoke(messages, timeout=timeout)
+            )
+            self.prompt_cache.record(response)
+            self._record_usage(response, started_at)
+            ai_text = getattr(response, "content", str(response))
+            return ai_text.strip()
+
+        except Exception as e:
+            return self._handle_ai_error("Error getting AI response", e)
+
+    async def astream_ai_response(self, prompt: PromptInput) -> AsyncIterator[Tuple[str, str]]:
+        """Async generator of parser events built on astream.
+
+        Yields ("narrative", delta) and ("option", text) as they arrive, then a
+        final ("reply", raw_reply) which is empty if the request failed.
+        """
+        parser = StreamingReplyParser()
+        try:
+            if not self.llm and not self.set_model(self.state.current_model):
+                yield "reply", ""
+                return
+
+            messages = self._build_messages(prompt)
+            started_at = time.perf_counter()
+            chunks = self.resilience.astream(
+                self.state.current_model, self.llm,
+                lambda llm, timeout: llm.astream(messages, timeout=timeout)
+            )
+            async for chunk in chunks:
+                self.prompt_cache.record(chunk)
+                self._record_usage(chunk, started_at)
+                content = getattr(chunk, "content", "")
+                if not isinstance(content, str) or not content:
+                    continue
+                for event in parser.feed(content):
+                    yield event
+            ai_reply = parser.text.strip()
+
+        except Exception as e:
+            ai_reply = self._handle_ai_error("Error streaming AI response", e)
+        yield "reply", ai_reply
+
+    def _parse_ai_reply(self, ai_reply: str) -> Tuple[str, List[str]]:
+        return _parse_reply_text(ai_reply)
+
+    def _apply_reply(self, record: TurnRecord) -> TurnResult:
+        """Expose record as the latest Dungeon Master reply"""
+        self.state.last_ai_reply_raw = record.raw_reply
+        self.state.last_ai_reply = record.narrative
+        self.state.last_options = list(record.options)
+        return TurnResult(
+            ok=True,
+            narrative=record.narrative,
+            options=list(record.options),
+            raw_reply=record.raw_reply,
+            action=record.action
+        )
+
+    def new_game(self, genre: str, role: str, name: str,
+                 on_event: Optional[Callable[[str, str], None]] = None) -> TurnResult:
+        """Start a new adventure and generate the opening scene"""
+        if genre not in ROLE_STARTERS:
+            return TurnResult(ok=False, error=f"Unknown genre: {genre}")
+
+        self.state.selected_genre = genre
+        self.state.selected_role = role
+        self.state.character_name = name.strip() or "Alex"
+
+        # Initial setup
+        self.state.setting = self._build_setting(genre, role, self.state.character_name)
+        self._cancel_speculation()
+        self._reset_story()
+        self.state.last_options = []
+        self.state.last_ai_reply = ""
+        self.state.last_ai_reply_raw = ""
+        self.state.last_player_input = ""
+        self.state.adventure_started = False
+
+        # Get first response
+        started_at = time.time()
+        ai_reply = self._baked_opening(on_event)
+        if ai_reply is None:
+            ai_reply = self._speculative_opening(on_event)
+        if ai_reply is None:
+            with self._usage_kind("opening"):
+                ai_reply = self._request_reply(self._render_prompt(), on_event)
+        if not ai_reply:
+            return TurnResult(ok=False, error="Failed to get initial response from AI.")
+        record = self._commit_turn("", ai_reply, started_at)
+        self.state.adventure_started = True
+        result = self._apply_reply(record)
+        self._start_speculation()
+        return result
+
+    @property
+    def language(self) -> str:
+        return "zh" if self.use_chinese else "en"
+
+    def _build_setting(self, genre: str, role: str, name: str) -> str:
+        language_note = "Output Language: Chinese\n" if self.use_chinese else ""
+        return (
+            f"### Adventure Setting ###\n"
+            f"Genre: {genre}\n"
+            f"Player Character: {name} the {role}\n"
+            f"Starting Scenario: {_get_starter(genre, role)}\n"
+            f"{language_note}\n"
+        )
+
+    def _baked_opening(self, on_event: Optional[Callable[[str, str], None]]) -> Optional[str]:
+        """Take a pre-generated opening scene from the bundle, if one exists"""
+        if self.openings is None:
+            return None
+        ai_reply = self.openings.sample(
+            self.language, self.state.selected_genre, self.state.selected_role, self.state.character_name
+        )
+        _replay_events(ai_reply, on_event)
+        return ai_reply
+
+    def generate_opening(self, genre: str, role: str) -> str:
+        """Generate an opening scene that uses NAME_PLACEHOLDER for the character's name.
+
+        Returns "" unless the model produced a valid JSON reply.
+        """
+        placeholder = OpeningBundle.NAME_PLACEHOLDER
+        state = GameState(
+            setting=self._build_setting(genre, role, placeholder)
+            + f"(Write {placeholder} exactly wherever the character's name appears.)\n"
+        )
+        messages = self.context.build(state, self.state.current_model, self.system_prompt.strip()).messages
+        with self._usage_kind("opening"):
+            ai_reply = self.get_ai_response(messages)
+        narrative, _ = self._parse_ai_reply(ai_reply)
+        if not narrative or narrative == ai_reply.strip() or OpeningBundle.has_mangled_placeholder(ai_reply):
+            return ""
+        return ai_reply
+
+    def prepare_opening(self, genre: str, role: str) -> None:
+        """Start generating the opening scene before the character's name is known.
+
+        new_game() picks the result up if it is called with the same genre and
+        role, filling in the name; otherwise it falls back to a live request.
+        """
+        self._pending_opening = None
+        if genre not in ROLE_STARTERS:
+            return
+        if self.openings is not None and self.openings.sample(self.language, genre, role, ""):
+            return
+        if not self.llm and not self.set_model(self.state.current_model):
+            return
+
+        future: Future = Future()
+        future.set_running_or_notify_cancel()
+
+        def _generate():
+            try:
+                future.set_result(self.generate_opening(genre, role))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=_generate, daemon=True, name="opening").start()
+        self._pending_opening = (genre, role, self.language, future)
+
+    def _speculative_opening(self, on_event: Optional[Callable[[str, str], None]]) -> Optional[str]:
+        pending, self._pending_opening = self._pending_opening, None
+        if pending is None:
+            return None
+        genre, role, language, future = pending
+        if (genre, role, language) != (self.state.selected_genre, self.state.selected_role, self.language):
+            return None
+        try:
+            raw_reply = future.result()
+        except Exception as e:
+            self.log_error("Speculative opening failed", e)
+            return None
+        ai_reply = OpeningBundle.personalize(raw_reply, self.state.character_name) if raw_reply else None
+        _replay_events(ai_reply, on_event)
+        return ai_reply
+
+    def _render_prompt(self, pending_action: Optional[str] = None) -> list:
+        return self.context.build(
+            self.state, self.state.current_model, self.system_prompt.strip(),
+            pending_action, memory=self.state.story_summary
+        ).messages
+
+    def _build_turn_prompt(self, user_input: str) -> list:
+        return self._render_prompt(user_input)
+
+    def _commit_turn(self, user_input: str, ai_reply: str, started_at: float) -> TurnRecord:
+        """Append a completed turn to the turn log"""
+        with self.perf.span("parse"):
+            narrative, options = self._parse_ai_reply(ai_reply)
+        reply_text = ai_reply.strip()
+        record = TurnRecord(
+            action=user_input,
+            raw_reply=reply_text,
+            narrative=narrative if narrative else reply_text,
+            options=list(options),
+            started_at=started_at,
+            finished_at=time.time(),
+            model=self._turn_route[0] or self.state.current_model,
+            route_reason=self._turn_route[1]
+        )
+        self._turn_route = ("", "")
+        self.state.turns.append(record)
+        if user_input:
+            self.state.player_turns += 1
+            self.state.last_player_input = user_input
+        self._schedule_summary()
+        return record
+
+    def _reset_story(self) -> None:
+        """Forget the turn log and memory before starting or loading a story"""
+        self._clear_alternates()
+        with self._summary_lock:
+            self._story_generation += 1
+            self.state.turns = []
+            self.state.player_turns = 0
+            self.state.story_summary = ""
+            self.state.summarized_turns = 0
+            self.state.context_start = 0
+
+    def _schedule_summary(self) -> None:
+        """Fold turns that no longer fit in the prompt into the story summary.
+
+        Runs on a background worker so the reply is never delayed; evicted
+        turns are batched to keep the number of extra LLM calls low.
+        """
+        batch = CONFIG["SUMMARY_BATCH_TURNS"]
+        if batch <= 0 or self._summary_pending or not self.llm:
+            return
+        with self._summary_lock:
+            start = self.state.summarized_turns
+            summary = self.state.story_summary
+            generation = self._story_generation
+        # Where the prompt just built started its window; everything before it has been evicted
+        end = min(self.state.context_start, len(self.state.turns))
+        if end - start < batch:
+            return
+        evicted = self.state.turns[start:end]
+        self._summary_pending = True
+        self._summary_executor.submit(self._summarize, summary, evicted, end, generation, self.llm)
+
+    def _summarize(self, summary: str, evicted: List[TurnRecord], end: int,
+                   generation: int, llm: ChatOpenAI) -> None:
+        try:
+            events = []
+            for turn in evicted:
+                if turn.action:
+                    events.append(f"Player: {turn.action}")
+                events.append(f"Dungeon Master: {turn.narrative}")
+            messages = [
+                SystemMessage(content=SUMMARY_SYSTEM_PROMPT.strip()),
+                HumanMessage(content=(
+                    f"### Current Summary ###\n{summary or '(none yet)'}\n\n"
+                    "### New Events ###\n" + "\n".join(events)
+                ))
+            ]
+            started_at = time.perf_counter()
+            response = self.resilience.run(
+                self.state.current_model, llm,
+                lambda client, timeout: client.invoke(messages, timeout=timeout)
+            )
+            self._record_usage(response, started_at, kind="summary")
+            new_summary = str(getattr(response, "content", "")).strip()
+            if new_summary:
+                with self._summary_lock:
+                    if generation == self._story_generation:
+                        self.state.story_summary = new_summary
+                        self.state.summarized_turns = end
+        except Exception as e:
+            self.log_error("Error updating story summary", e)
+        finally:
+            self._summary_pending = False
+
+    def close(self) -> None:
+        """Stop background work; pending saves are finished, summaries and speculative replies dropped"""
+        self._save_executor.shutdown(wait=True)
+        self._summary_executor.shutdown(wait=False, cancel_futures=True)
+        if self._alternates_executor is not None:
+            self._alternates_executor.shutdown(wait=False, cancel_futures=True)
+        if self._variants_executor is not None:
+            self._variants_executor.shutdown(wait=False, cancel_futures=True)
+        if self.speculator is not None:
+            self.speculator.shutdown()
+
+    def _autosave_due(self) -> bool:
+        # Auto-save every 5 interactions
+        return self.state.player_turns % 5 == 0
+
+    def act(self, text: str, on_event: Optional[Callable[[str, str], None]] = None) -> TurnResult:
+        """Play one turn with a free-form player action"""
+        action = text.strip()
+        if not action:
+            return TurnResult(ok=False, error="Empty action.")
+
+        started_at = time.time()
+        with self.perf.span("prompt_build"):
+            messages = self._build_turn_prompt(action)
+        ai_reply = self._take_speculative_reply(action, on_event)
+        if ai_reply is None:
+            ai_reply = self._request_reply(messages, on_event)
+        if not ai_reply:
+            return TurnResult(ok=False, action=action, error="Failed to get response from AI. Please try again.")
+
+        self._clear_alternates()
+        result = self._apply_reply(self._commit_turn(action, ai_reply, started_at))
+        result.autosave_failed = self.autosave_failed()
+        if self._autosave_due():
+            with self.perf.span("autosave"):
+                result.autosaved = self.autosave()
+        self._start_speculation()
+        self._prefetch_alternates(action, messages)
+        return result
+
+    def choose(self, option_index: int, on_event: Optional[Callable[[str, str], None]] = None) -> TurnResult:
+        """Play one of the last suggested actions (0-based index)"""
+        if not 0 <= option_index < len(self.state.last_options):
+            return TurnResult(ok=False, error="Invalid option number.")
+        return self.act(self.state.last_options[option_index], on_event)
+
+    def _start_speculation(self) -> None:
+        """Begin generating replies for the suggested options in the background"""
+        if self.speculator is None or not self.llm:
+            return
+        jobs = [
+            (option, self._build_turn_prompt(option))
+            for option in self.state.last_options
+        ]
+        self.speculator.start(self.llm, jobs)
+
+    def _take_speculative_reply(self, action: str,
+                                on_event: Optional[Callable[[str, str], None]]) -> Optional[str]:
+        if self.speculator is None:
+            return None
+        with self.perf.span("speculative_wait"):
+            ai_reply = self.speculator.take(action)
+        _replay_events(ai_reply, on_event)
+        return ai_reply
+
+    def _cancel_speculation(self) -> None:
+        if self.speculator is not None:
+            self.speculator.cancel_all()
+
+    def _remove_last_turn(self) -> Optional[TurnRecord]:
+        """Pop the last player turn from the turn log"""
+        if not self.state.turns or not self.state.turns[-1].action:
+            return None
+        self.state.player_turns -= 1
+        return self.state.turns.pop()
+
+    def _restore_turn(self, record: TurnRecord) -> None:
+        self.state.turns.append(record)
+        self.state.player_turns += 1
+
+    def redo(self, on_event: Optional[Callable[[str, str], None]] = None) -> TurnResult:
+        """Regenerate the reply to the last player action"""
+        action = self.state.last_player_input
+        if not (self.state.last_ai_reply and action):
+            return TurnResult(ok=False, error="Nothing to redo.")
+
+        self._cancel_speculation()
+        removed = self._remove_last_turn()
+        if removed is None:
+            return TurnResult(ok=False, error="Nothing to redo.")
+        started_at = time.time()
+        new_reply = self._take_alternate(action, on_event)
+        if new_reply is None:
+            with self._usage_kind("redo"):
+                new_reply = self._request_redo_reply(action, on_event)
+        if not new_reply:
+            self._restore_turn(removed)
+            return TurnResult(ok=False, action=action, error="Failed to generate new response.")
+
+        result = self._apply_reply(self._commit_turn(action, new_reply, started_at))
+        self._start_speculation()
+        return result
+
+    def _alternates_key(self, action: str) -> tuple:
+        # Identifies the turn being redone: same story, same position, same action
+        return (self._story_generation, len(self.state.turns), action)
+
+    def _generate_candidates(self, llm: ChatOpenAI, messages: list, count: int) -> List[str]:
+        """Request `count` alternative replies to the same prompt in a single call"""
+        try:
+            started_at = time.perf_counter()
+            result = self.resilience.run(
+                self.state.current_model, llm,
+                lambda client, timeout: client.generate([messages], n=count, timeout=timeout)
+            )
+            generations = result.generations[0]
+            if generations:
+                # Every generation carries the usage of the whole call
+                message = getattr(generations[0], "message", None)
+                self.prompt_cache.record(message)
+                self._record_usage(message, started_at, kind="redo")
+            return [generation.text.strip() for generation in generations if generation.text.strip()]
+        except Exception as e:
+            self.log_error("Error generating alternative replies", e)
+            return []
+
+    def _prefetch_alternates(self, action: str, messages: list) -> None:
+        """Fetch replies for a future /redo in the background, all in one call"""
+        if self.redo_alternates <= 0 or not self.llm:
+            return
+        if self._alternates_executor is None:
+            self._alternates_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="alternates")
+        # The turn has been committed already; /redo will see the log one turn shorter
+        self._alternates_key_value = (self._story_generation, len(self.state.turns) - 1, action)
+        self._alternates_future = self._alternates_executor.submit(
+            self._generate_candidates, self.llm, messages, self.redo_alternates
+        )
+        self._alternates = []
+
+    def _take_alternate(self, action: str, on_event: Optional[Callable[[str, str], None]]) -> Optional[str]:
+        """Return the next cached alternative for the turn being redone, if any"""
+        if self._alternates_key_value != self._alternates_key(action):
+            self._clear_alternates()
+            return None
+        if self._alternates_future is not None:
+            # Still in flight: waiting is cheaper than starting another request
+            self._alternates = self._alternates_future.result()
+            self._alternates_future = None
+        if not self._alternates:
+            return None
+        ai_reply = self._alternates.pop(0)
+        _replay_events(ai_reply, on_event)
+        return ai_reply
+
+    def _request_redo_reply(self, action: str, on_event: Optional[Callable[[str, str], None]]) -> str:
+        messages = self._build_turn_prompt(action)
+        if self.redo_alternates <= 0 or not self.llm:
+            return self._request_reply(messages, on_event)
+        # Out of alternatives: fetch the reply plus a fresh batch in one round trip
+        candidates = self._generate_candidates(self.llm, messages, self.redo_alternates + 1)
+        if not candidates:
+            return ""
+        self._alternates_key_value = self._alternates_key(action)
+        self._alternates_future = None
+        self._alternates = candidates[1:]
+        _replay_events(candidates[0], on_event)
+        return candidates[0]
+
+    def _clear_alternates(self) -> None:
+        self._alternates_key_value = None
+        self._alternates_future = None
+        self._alternates = []
+
+    def generate_variants(self, count: int, deadline: float = CONFIG["VARIANTS_DEADLINE"]) -> List[TurnResult]:
+        """Generate up to `count` replies to the last player action concurrently, without committing any"""
+        action = self.state.last_player_input
+        if not (self.state.last_ai_reply and action) or not self.state.turns or self.state.turns[-1].action != action:
+            return []
+        if not self.llm and not self.set_model(self.state.current_model):
+            return []
+        count = max(1, min(count, CONFIG["VARIANTS_MAX"]))
+
+        # Build the prompt as it was before the last reply, then put the turn straight back
+        removed = self._remove_last_turn()
+        messages = self._build_turn_prompt(action)
+        self._restore_turn(removed)
+
+        if self._variants_executor is None:
+            self._variants_executor = ThreadPoolExecutor(max_workers=CONFIG["VARIANTS_MAX"],
+                                                         thread_name_prefix="variants")
+        expires_at = time.monotonic() + deadline
+        futures = [self._variants_executor.submit(self._generate_variant, self.llm, messages, expires_at)
+                   for _ in range(count)]
+        # One deadline for the whole batch: stragglers are dropped, not waited on
+        done, not_done = wait(futures, timeout=deadline)
+        for future in not_done:
+            future.cancel()
+
+        variants = []
+        seen = set()
+        for future in futures:
+            if future not in done:
+                continue
+            ai_reply = future.result()
+            if not ai_reply or ai_reply in seen:
+                continue
+            seen.add(ai_reply)
+            narrative, options = self._parse_ai_reply(ai_reply)
+            variants.append(TurnResult(ok=True, narrative=narrative, options=options,
+                                       raw_reply=ai_reply, action=action))
+        return variants
+
+    def _generate_variant(self, llm: ChatOpenAI, messages: list, expires_at: float) -> str:
+        if time.monotonic() >= expires_at:
+            return ""
+        try:
+            started_at = time.perf_counter()
+            # A running request cannot be cancelled, so the batch deadline caps its timeout instead
+            response = self.resilience.run(
+                self.state.current_model, llm,
+                lambda client, timeout: client.invoke(
+                    messages, timeout=max(0.1, min(timeout, expires_at - time.monotonic()))
+                ),
+                can_retry=lambda: time.monotonic() < expires_at
+            )
+            self.prompt_cache.record(response)
+            self._record_usage(response, started_at, kind="variants")
+            return getattr(response, "content", str(response)).strip()
+        except Exception as e:
+            self.log_error("Error generating variant", e)
+            return ""
+
+    def commit_variant(self, variant: TurnResult) -> TurnResult:
+        """Replace the reply to the last player action with a chosen variant"""
+        turns = self.state.turns
+        if not turns or turns[-1].action != variant.action or not variant.raw_reply:
+            return TurnResult(ok=False, error="The story has moved on; that variant no longer applies.")
+
+        self._cancel_speculation()
+        self._clear_alternates()
+        removed = self._remove_last_turn()
+        result = self._apply_reply(self._commit_turn(variant.action, variant.raw_reply, removed.started_at))
+        self._start_speculation()
+        return result
+
+    def snapshot(self) -> dict:
+        """Return a JSON-serialisable copy of the current game state"""
+        return asdict(self.state)
+
+    def _build_save_data(self) -> dict:
+        """Snapshot the state for saving; turns stay records until the writer serialises them"""
+        return {
+            "setting": self.state.setting,
+            "turns": list(self.state.turns),
+            "memory": {
+                "summary": self.state.story_summary,
+                "summarized_turns": self.state.summarized_turns
+            },
+            "metadata": {
+                "character_name": self.state.character_name,
+                "genre": self.state.selected_genre,
+                "role": self.state.selected_role,
+                "model": self.state.current_model,
+                "save_time": datetime.datetime.now().isoformat(),
+                "usage": self.usage.to_dict()
+            }
+        }
+
+    def _write_save_data(self, save_data: dict, sequence: Optional[int] = None) -> bool:
+        if sequence is not None and sequence != self._save_sequence:
+            # A newer snapshot is already queued behind this one
+            return True
+        try:
+            save_data = {**save_data, "turns": [turn.to_dict() for turn in save_data["turns"]]}
+            with open(CONFIG["SAVE_FILE"], "w", encoding="utf-8") as f:
+                json.dump(save_data, f, ensure_ascii=False)
+            return True
+        except Exception as e:
+            self.log_error("Error saving adventure", e)
+            return False
+
+    def _submit_save(self) -> Optional[Future]:
+        try:
+            self._save_sequence += 1
+            return self._save_executor.submit(self._write_save_data, self._build_save_data(), self._save_sequence)
+        except Exception as e:
+            self.log_error("Error saving adventure", e)
+            return None
+
+    def save(self) -> bool:
+        """Save adventure to file with error handling"""
+        future = self._submit_save()
+        return future is not None and future.result()
+
+    def autosave(self) -> bool:
+        """Queue a save without waiting for the write; see autosave_failed() for the outcome"""
+        future = self._submit_save()
+        if future is None:
+            return False
+        self._autosave = future
+        return True
+
+    def autosave_failed(self) -> bool:
+        """Whether the last queued autosave has finished and failed; each failure is reported once"""
+        future = self._autosave
+        if future is None or not future.done():
+            return False
+        self._autosave = None
+        return not future.result()
 
-DM_SYSTEM_PROMPT_EN = """
-You are a masterful Dungeon Master in an unrestricted SFW adventure. Your role is to **always** narrate the consequences of player actions, no matter how extreme, bizarre, violent or unconventional they may be. Follow these rules:
+    def load(self) -> TurnResult:
+        """Load adventure from file; the result carries the last Dungeon Master reply"""
+        try:
+            if not os.path.exists(CONFIG["SAVE_FILE"]):
+                return TurnResult(ok=False, error="No saved adventure found.")
 
-1. ACTION-CONSEQUENCE SYSTEM:
-   - Describe ONLY the consequences of the player's action
-   - Never perform actions on behalf of the player
-   - Consequences must permanently change the game world
-   - Narrate consequences naturally within the story flow
-   - All actions are allowed and must always have some kind of reaction
+            with open(CONFIG["SAVE_FILE"], "r", encoding="utf-8") as f:
+                save_data = json.load(f)
 
-2. RESPONSE STYLE:
-   - Describe what happens in the world as a result of the player's action
-   - Do not describe the player performing actions - the player has already done that
-   - Never ask "what do you do next" or similar
-   - Always continue the story in a way that feels immersive
-   - Ensure the narrative spans at least five sentences, vividly covering sights, sounds, emotions, and lasting consequences                                                          │
+            self._cancel_speculation()
+            self._reset_story()
+            if "turns" in save_data:
+                self.state.setting = save_data.get("setting", "")
+                self.state.turns = [TurnRecord(**turn) for turn in save_data["turns"]]
+            else:
+                self.state.setting, self.state.turns = self._turns_from_conversation(save_data["conversation"])
+            self.state.player_turns = sum(1 for turn in self.state.turns if turn.action)
+            memory = save_data.get("memory", {})
+            self.state.story_summary = memory.get("summary", "")
+            self.state.summarized_turns = min(memory.get("summarized_turns", 0), len(self.state.turns))
+            metadata = save_data.get("metadata", {})
 
-3. WORLD EVOLUTION:
-   - NPCs remember player choices and react accordingly
-   - Environments change permanently based on actions
-   - Player choices open/close future narrative paths
-   - Resources, factions, and the world evolve with every decision
+            self.state.character_name = metadata.get("character_name", "Alex")
+            self.state.selected_genre = metadata.get("genre", "Fantasy")
+            self.state.selected_role = metadata.get("role", "Adventurer")
+            if "usage" in metadata:
+                self.usage.load(metadata["usage"])
+            saved_model = metadata.get("model", CONFIG["DEFAULT_MODEL"])
+            if not self.set_model(saved_model):
+                self.set_model(CONFIG["DEFAULT_MODEL"])
 
-4. PLAYER AGENCY:
-   - The player can attempt **anything**
-   - Never block an action—show the results, good or bad
-   - Let the world react dynamically and permanently
+            # Extract last AI reply
+            self.state.last_player_input = ""
+            self.state.adventure_started = True
+            if self.state.turns:
+                result = self._apply_reply(self.state.turns[-1])
+                self._start_speculation()
+                return result
+            self.state.last_ai_reply_raw = ""
+            self.state.last_ai_reply = ""
+            self.state.last_options = []
+            return TurnResult(ok=True)
 
-5. OUTPUT FORMAT:
-   - Return your entire reply strictly as a JSON object with the following structure:
-     {"narrative": "...", "options": ["...", "...", "..."]}
-   - "narrative" must describe the consequences of the player's most recent action.
-   - "options" must contain 3 or 4 distinct, concise action suggestions for what the player might do next.
-   - All string values must be written in the same language as the rest of the adventure.
-   - Do not include any additional text outside of the JSON object.
+        except Exception as e:
+            self.log_error("Error loading adventure", e)
+            return TurnResult(ok=False, error="Failed to load adventure.")
 
-Never break character as the Dungeon Master. Always continue the adventure.
-"""
+    def _turns_from_conversation(self, conversation: str) -> Tuple[str, List[TurnRecord]]:
+        """Split a legacy single-string save into the setting header and turn log"""
+        header_end = conversation.find("Dungeon Master:")
+        if header_end == -1:
+            return conversation, []
 
-DM_SYSTEM_PROMPT_ZH = DM_SYSTEM_PROMPT_EN + "\nAll responses must be written entirely in Simplified Chinese.\n"
+        turns: List[TurnRecord] = []
+        segments = conversation[header_end + len("Dungeon Master:"):].split("\nPlayer: ")
+        for index, segment in enumerate(segments):
+            if index == 0:
+                action, reply = "", segment
+            else:
+                action, _, reply = segment.partition("\nDungeon Master:")
+            reply = reply.strip()
+            if not reply:
+                continue
+            narrative, options = self._parse_ai_reply(reply)
+            turns.append(TurnRecord(action=action.strip(), raw_reply=reply, narrative=narrative or reply, options=options))
+        return conversation[:header_end], turns
+
+    async def step(self, action: str) -> TurnResult:
+        """Play one turn asynchronously; autosaves run in the background"""
+        action = action.strip()
+        if not action:
+            return TurnResult(ok=False, error="Empty action.")
+        self._cancel_speculation()
+        started_at = time.time()
+        reason = self._route_turn()
+        ai_reply = await self.aget_ai_response(self._build_turn_prompt(action))
+        self._note_turn_route(reason, ai_reply)
+        return self._finish_async_turn(action, ai_reply, started_at)
+
+    async def stream_step(self, action: str) -> AsyncIterator[Tuple[str, str]]:
+        """Play one turn asynchronously, yielding parser events as they stream in.
+
+        The final ("reply", raw_reply) event is yielded after the turn is committed;
+        it is empty if the action was empty or the request failed.
+        """
+        action = action.strip()
+        if not action:
+            yield "reply", ""
+            return
+        self._cancel_speculation()
+        started_at = time.time()
+        reason = self._route_turn()
+        async for kind, text in self.astream_ai_response(self._build_turn_prompt(action)):
+            if kind == "reply":
+                self._note_turn_route(reason, text)
+                self._finish_async_turn(action, text, started_at)
+            yield kind, text
+
+    def _finish_async_turn(self, action: str, ai_reply: str, started_at: float) -> TurnResult:
+        if not ai_reply:
+            return TurnResult(ok=False, action=action, error="Failed to get response from AI. Please try again.")
+        result = self._apply_reply(self._commit_turn(action, ai_reply, started_at))
+        if self._autosave_due():
+            self._schedule_background(self.asave())
+        return result
+
+    def _schedule_background(self, coro) -> asyncio.Task:
+        """Run a coroutine alongside the game, keeping a reference until it finishes"""
+        task = asyncio.get_running_loop().create_task(coro)
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
+        return task
+
+    async def drain_background(self) -> None:
+        """Wait for pending background work such as autosaves"""
+        while self._background_tasks:
+            await asyncio.gather(*list(self._background_tasks), return_exceptions=True)
+
+    async def asave(self) -> bool:
+        """Snapshot the state on the event loop and write it from the save thread"""
+        future = self._submit_save()
+        return future is not None and await asyncio.wrap_future(future)
+
+class SpeechWorker:
+    """One long-lived thread that speaks queued text with espeak-ng.
+
+    say() drops anything still waiting and interrupts the current utterance,
+    since a newer reply makes them stale. The queue holds at most max_pending
+    items; when it is full the oldest waiting utterance is dropped. cancel()
+    silences everything, flush() waits until the queue has been spoken.
+    """
+
+    def __init__(self, max_pending: int = CONFIG["TTS_QUEUE_SIZE"],
+                 on_error: Optional[Callable[[str, Exception], None]] = None,
+                 command: Tuple[str, ...] = ("espeak-ng",)):
+        self.command = command
+        self.on_error = on_error
+        self.available = True
+        self.spoken = 0
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Tuple[int, str]]]" = queue.Queue(maxsize=max_pending)
+        self._lock = threading.Lock()
+        # Bumped by cancel(); anything queued or started under an older value is stale
+        self._generation = 0
+        self._process: Optional[subprocess.Popen] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def say(self, text: str, interrupt: bool = True) -> None:
+        """Queue text for speaking, replacing stale speech when interrupt is set"""
+        if not self.available or not text.strip():
+            return
+        if interrupt:
+            self.cancel()
+        self._ensure_thread()
+        while True:
+            try:
+                self._queue.put_nowait((self._generation, text))
+                return
+            except queue.Full:
+                self._drop_one()
+
+    def cancel(self) -> None:
+        """Drop every waiting utterance and stop the one being spoken"""
+        with self._lock:
+            self._generation += 1
+            process = self._process
+        while self._drop_one():
+            pass
+        if process is not None and process.poll() is None:
+            process.terminate()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Wait until everything queued has been spoken; False on timeout"""
+        if self._thread is None:
+            return True
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def close(self) -> None:
+        self.cancel()
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout=2)
+            self._thread = None
+
+    def _drop_one(self) -> bool:
+        try:
+            self._queue.get_nowait()
+        except queue.Empty:
+            return False
+        self._queue.task_done()
+        self.dropped += 1
+        return True
+
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="tts")
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                self._speak(*item)
+            finally:
+                self._queue.task_done()
+
+    def _speak(self, generation: int, text: str) -> None:
+        try:
+            with self._lock:
+                if generation != self._generation:
+                    self.dropped += 1
+                    return
+                self._process = subprocess.Popen([*self.command, text], stdout=subprocess.DEVNULL,
+                                                 stderr=subprocess.DEVNULL)
+            returncode = self._process.wait()
+            # Negative return codes mean we terminated it on purpose
+            if returncode > 0:
+                raise subprocess.CalledProcessError(returncode, self.command[0])
+            if returncode == 0:
+                self.spoken += 1
+        except FileNotFoundError as e:
+            self.available = False
+            if self.on_error:
+                self.on_error(f"{self.command[0]} command not found", e)
+        except subprocess.CalledProcessError as e:
+            if self.on_error:
+                self.on_error(f"{self.command[0]} command failed", e)
+        except Exception as e:
+            if self.on_error:
+                self.on_error("Error in TTS", e)
+        finally:
+            with self._lock:
+                self._process = None
 
 class AdventureGame:
-    def __init__(self, use_chinese: bool = False, enable_tts: bool = False):
-        self.state = GameState()
-        self.llm: Optional[ChatOpenAI] = None
-        self._audio_lock = threading.Lock()
+    """Console front-end for an AdventureSession"""
+
+    def __init__(self, use_chinese: bool = False, enable_tts: bool = False, stream_output: bool = False,
+                 speculate: bool = False, model_name: Optional[str] = None, redo_alternates: int = 0,
+                 hedge: bool = False, fallback_model: Optional[str] = CONFIG["FALLBACK_MODEL"],
+                 route: bool = False, base_url: Optional[str] = CONFIG["BASE_URL"],
+                 perf: Optional[PerfRecorder] = None):
+        self.session = AdventureSession(use_chinese=use_chinese, speculate=speculate, redo_alternates=redo_alternates,
+                                        hedge=hedge, fallback_model=fallback_model, route=route, base_url=base_url,
+                                        perf=perf)
+        self.perf = self.session.perf
+        self.profiler = SessionProfiler()
+        self.session.openings = self._load_openings()
+        self.model_name = model_name
+        self.speech = SpeechWorker(on_error=self.log_error)
         self.use_chinese = use_chinese
         self.tts_enabled = enable_tts
-        self.system_prompt = DM_SYSTEM_PROMPT_ZH if use_chinese else DM_SYSTEM_PROMPT_EN
+        self.stream_output = stream_output
         self._setup_directories()
-        
+
+    @property
+    def state(self) -> GameState:
+        return self.session.state
+
+    def _load_openings(self) -> Optional[OpeningBundle]:
+        """Load the baked opening scenes, if any were generated with --bake-openings"""
+        if not os.path.exists(CONFIG["OPENINGS_FILE"]):
+            return None
+        try:
+            return OpeningBundle.load()
+        except Exception as e:
+            self.log_error("Error loading baked opening scenes", e)
+            return None
+
     def _setup_directories(self):
         """Ensure necessary directories exist"""
         os.makedirs("logs", exist_ok=True)
         os.makedirs("saves", exist_ok=True)
-    
+
     def log_error(self, error_message: str, exception: Optional[Exception] = None) -> None:
-        """Enhanced error logging with rotation"""
-        try:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-            log_path = CONFIG["LOG_FILE"]
-            
-            with open(log_path, "a", encoding="utf-8") as log_file:
-                log_file.write(f"\n--- ERROR [{timestamp}] ---\n")
-                log_file.write(f"Message: {error_message}\n")
-                
-                if exception:
-                    log_file.write(f"Exception: {type(exception).__name__}: {str(exception)}\n")
-                    traceback.print_exc(file=log_file)
-                
-                log_file.write(f"Game State: Model={self.state.current_model}, ")
-                log_file.write(f"Genre={self.state.selected_genre}, Role={self.state.selected_role}\n")
-                log_file.write("--- END ERROR ---\n")
-                
-        except Exception as e:
-            print(f"CRITICAL: Failed to write to error log: {e}")
+        self.session.log_error(error_message, exception)
 
     def _validate_openai_credentials(self) -> bool:
-        if os.getenv("OPENAI_API_KEY"):
+        if os.getenv("OPENAI_API_KEY") or self.session.base_url:
             return True
         print("OpenAI API key not found. Please set the OPENAI_API_KEY environment variable.")
         return False
 
-    def _create_llm(self, model_name: str) -> ChatOpenAI:
-        return ChatOpenAI(
-            model=model_name,
-            temperature=0.7,
-            timeout=CONFIG["REQUEST_TIMEOUT"],
-            max_retries=2,
-        )
-
     def _set_model(self, model_name: str) -> bool:
-        try:
-            self.llm = self._create_llm(model_name)
-            self.state.current_model = model_name
+        if self.session.set_model(model_name):
             return True
-        except Exception as e:
-            self.log_error(f"Failed to initialize model '{model_name}'", e)
-            print(f"Failed to initialize model '{model_name}'. Please verify the model name and your OpenAI credentials.")
-            return False
-
-    def _truncate_prompt(self, prompt: str) -> str:
-        if len(prompt) <= CONFIG["MAX_CONVERSATION_LENGTH"]:
-            return prompt
-        recent_conversation = prompt[-4000:]
-        return "[Earlier conversation truncated...]\n" + recent_conversation
+        print(f"Failed to initialize model '{model_name}'. Please verify the model name and your OpenAI credentials.")
+        return False
 
     def select_model(self) -> str:
         """Prompt the user for an OpenAI model name"""
@@ -296,92 +2843,68 @@ class AdventureGame:
         ).strip()
         return model_input or CONFIG["DEFAULT_MODEL"]
 
-    def get_ai_response(self, prompt: str) -> str:
-        """Get AI response with enhanced error handling and prompt optimization"""
-        try:
-            trimmed_prompt = self._truncate_prompt(prompt)
+    def _run_turn(self, engine_call: Callable[[Optional[Callable[[str, str], None]]], TurnResult]) -> TurnResult:
+        """Run an engine call, streaming narrative and options to the console when enabled"""
+        if not self.stream_output:
+            result = engine_call(None)
+            if result.ok:
+                with self.perf.span("display"):
+                    self._display_ai_reply(result.narrative, result.options)
+            return result
 
-            if not self.llm and not self._set_model(self.state.current_model):
-                return ""
+        narrative_printed = False
+        options_printed = 0
 
-            response = self.llm.invoke([
-                SystemMessage(content=self.system_prompt.strip()),
-                HumanMessage(content=trimmed_prompt)
-            ])
-            ai_text = getattr(response, "content", str(response))
-            return ai_text.strip()
+        def _print_event(kind: str, text: str) -> None:
+            nonlocal narrative_printed, options_printed
+            if kind == "narrative":
+                if not narrative_printed:
+                    print("\nDungeon Master: ", end="", flush=True)
+                    narrative_printed = True
+                print(text, end="", flush=True)
+            elif kind == "option":
+                if not options_printed:
+                    print()
+                    print("Suggested actions:" if not self.use_chinese else "建议行动：")
+                options_printed += 1
+                print(f"{options_printed}. {text}", flush=True)
 
-        except Exception as e:
-            error_text = str(e).lower()
-            if "timeout" in error_text:
-                self.log_error("AI request timed out", e)
-                return "The world seems to pause as if time has stopped. What would you like to do?"
-            self.log_error("Error getting AI response", e)
-            return ""
+        result = engine_call(_print_event)
+        if narrative_printed and not options_printed:
+            print()
+        if result.ok:
+            # A reply that turned out not to be JSON was never printed as narrative
+            parsed = result.narrative != result.raw_reply
+            with self.perf.span("display"):
+                self._display_ai_reply(
+                    result.narrative, result.options,
+                    narrative_shown=narrative_printed and parsed,
+                    options_shown=min(options_printed, len(result.options))
+                )
+        return result
 
     def speak(self, text: str) -> None:
         """Non-blocking text-to-speech using espeak-ng"""
         if not self.tts_enabled:
             return
-        if not text.strip():
-            return
-
-        def _speak_thread():
-            with self._audio_lock:
-                try:
-                    subprocess.run(["espeak-ng", text], check=True)
-                except FileNotFoundError as e:
-                    self.log_error("espeak-ng command not found", e)
-                except subprocess.CalledProcessError as e:
-                    self.log_error("espeak-ng command failed", e)
-                except Exception as e:
-                    self.log_error("Error in TTS", e)
-
-        # Start TTS in background thread
-        thread = threading.Thread(target=_speak_thread, daemon=True)
-        thread.start()
-
-    def _parse_ai_reply(self, ai_reply: str) -> Tuple[str, List[str]]:
-        reply_text = ai_reply.strip()
-        if not reply_text:
-            return "", []
-
-        try:
-            data = json.loads(reply_text)
-            if isinstance(data, dict):
-                narrative = str(data.get("narrative", "")).strip()
-                raw_options = data.get("options", [])
-                options: List[str] = []
-                if isinstance(raw_options, list):
-                    seen = set()
-                    for option in raw_options:
-                        if isinstance(option, str):
-                            cleaned = option.strip()
-                            if cleaned and cleaned not in seen:
-                                options.append(cleaned)
-                                seen.add(cleaned)
-                if len(options) > 4:
-                    options = options[:4]
-                return narrative, options
-        except json.JSONDecodeError:
-            pass
+        self.speech.say(text)
 
-        return reply_text, []
-
-    def _display_ai_reply(self, display_text: str, options: List[str], speak_output: bool = True, spoken_text: Optional[str] = None) -> None:
-        if display_text:
-            print(f"\nDungeon Master: {display_text}")
-        else:
-            print("\nDungeon Master:")
+    def _display_ai_reply(self, display_text: str, options: List[str], speak_output: bool = True, narrative_shown: bool = False, options_shown: int = 0) -> None:
+        if not narrative_shown:
+            if display_text:
+                print(f"\nDungeon Master: {display_text}")
+            else:
+                print("\nDungeon Master:")
 
-        text_to_speak = spoken_text if spoken_text is not None else display_text
-        if speak_output and text_to_speak:
-            self.speak(text_to_speak)
+        if speak_output and display_text:
+            with self.perf.span("tts_enqueue"):
+                self.speak(display_text)
 
         if options:
-            heading = "Suggested actions:" if not self.use_chinese else "建议行动："
-            print(heading)
-            for idx, option in enumerate(options, 1):
+            if not options_shown:
+                heading = "Suggested actions:" if not self.use_chinese else "建议行动："
+                print(heading)
+            for idx, option in enumerate(options[options_shown:], options_shown + 1):
                 print(f"{idx}. {option}")
         else:
             if self.use_chinese:
@@ -389,27 +2912,19 @@ class AdventureGame:
             else:
                 print("(No suggested actions were provided this turn. Feel free to enter your own action.)")
 
-    def _update_ai_reply(self, ai_reply: str, display: bool = True, speak_output: bool = True) -> None:
-        narrative, options = self._parse_ai_reply(ai_reply)
-        reply_text = ai_reply.strip()
-        display_text = narrative if narrative else reply_text
-        self.state.last_ai_reply_raw = reply_text
-        self.state.last_ai_reply = display_text
-        self.state.last_options = list(options)
-        if display:
-            spoken_text = narrative if narrative else None
-            self._display_ai_reply(display_text, options, speak_output, spoken_text=spoken_text)
-
     def show_help(self) -> None:
         """Display available commands"""
         print("""
 Available commands:
 /? or /help       - Show this help message
 /redo             - Repeat last AI response with a new generation
+/variants N       - Generate N alternative responses at once and pick one
 /save             - Save the full adventure to adventure.txt
 /load             - Load the adventure from adventure.txt
 /change           - Switch to a different OpenAI model
 /status           - Show current game status
+/perf [on|off]    - Show where turn time goes, or toggle timing
+/profile start|stop - Capture CPU and memory profiles to logs/
 /exit             - Exit the game
 """)
 
@@ -422,88 +2937,59 @@ Available commands:
         print(f"Adventure: {'Started' if self.state.adventure_started else 'Not started'}")
         if self.state.last_ai_reply:
             print(f"Last action: {self.state.last_player_input[:50]}...")
+        cache = self.session.prompt_cache
+        if cache.requests:
+            print(f"Prompt cache: {cache.last_cached_tokens}/{cache.last_prompt_tokens} tokens cached last turn, "
+                  f"{cache.hit_ratio:.0%} overall")
+        speculator = self.session.speculator
+        if speculator is not None:
+            stats = speculator.stats
+            print(f"Speculation: {stats.hits} hits / {stats.misses} misses "
+                  f"({stats.hit_rate:.0%}), {stats.latency_saved:.1f}s saved, "
+                  f"{speculator.remaining_calls} of {speculator.max_calls} calls left")
+        usage = self.session.usage
+        if usage.total.calls:
+            total = usage.total
+            print(f"Tokens: {total.prompt_tokens} in ({total.cached_tokens} cached), {total.completion_tokens} out "
+                  f"over {total.calls} calls, {total.tokens_per_sec:.0f} tok/s")
+            for label, groups in (("by kind", usage.by_kind), ("by model", usage.by_model)):
+                parts = [f"{name} {totals.prompt_tokens}+{totals.completion_tokens}" for name, totals in groups.items()]
+                print(f"  {label}: " + ", ".join(parts))
+        resilience = self.session.resilience
+        health = resilience.health.get(self.state.current_model)
+        if health is not None and health.requests:
+            print(f"Model health: {health.state}, {health.failures}/{health.requests} failed, "
+                  f"timeout {resilience.timeout_for(self.state.current_model):.0f}s, "
+                  f"{resilience.retries} retries, {resilience.fallbacks} fallbacks")
+        if self.session.router is not None and self.state.turns:
+            last_turn = self.state.turns[-1]
+            print(f"Routing: last turn served by {last_turn.model or 'unknown'}"
+                  + (f" ({last_turn.route_reason})" if last_turn.route_reason else ""))
+        hedger = self.session.hedger
+        if hedger is not None:
+            stats = hedger.stats
+            print(f"Hedging: {stats.hedged} hedges for {stats.requests} requests, {stats.hedge_wins} won, "
+                  f"{stats.capped} capped, threshold {hedger.delay():.1f}s")
         print("---------------------------")
 
-    def remove_last_ai_response(self) -> None:
-        """Remove the last AI response from conversation"""
-        pos = self.state.conversation.rfind("Dungeon Master:")
-        if pos != -1:
-            self.state.conversation = self.state.conversation[:pos].strip()
-
     def save_adventure(self) -> bool:
         """Save adventure to file with error handling"""
-        try:
-            save_data = {
-                "conversation": self.state.conversation,
-                "metadata": {
-                    "character_name": self.state.character_name,
-                    "genre": self.state.selected_genre,
-                    "role": self.state.selected_role,
-                    "model": self.state.current_model,
-                    "save_time": datetime.datetime.now().isoformat()
-                }
-            }
-            
-            with open(CONFIG["SAVE_FILE"], "w", encoding="utf-8") as f:
-                json.dump(save_data, f, indent=2, ensure_ascii=False)
-            
+        if self.session.save():
             print("Adventure saved successfully!")
             return True
-            
-        except Exception as e:
-            self.log_error("Error saving adventure", e)
-            print("Failed to save adventure.")
-            return False
+        print("Failed to save adventure.")
+        return False
 
     def load_adventure(self) -> bool:
         """Load adventure from file with error handling"""
-        try:
-            if not os.path.exists(CONFIG["SAVE_FILE"]):
-                print("No saved adventure found.")
-                return False
-
-            with open(CONFIG["SAVE_FILE"], "r", encoding="utf-8") as f:
-                save_data = json.load(f)
-
-            self.state.conversation = save_data["conversation"]
-            metadata = save_data.get("metadata", {})
-            
-            self.state.character_name = metadata.get("character_name", "Alex")
-            self.state.selected_genre = metadata.get("genre", "Fantasy")
-            self.state.selected_role = metadata.get("role", "Adventurer")
-            saved_model = metadata.get("model", CONFIG["DEFAULT_MODEL"])
-            if not self._set_model(saved_model):
-                print(f"Falling back to default model: {CONFIG['DEFAULT_MODEL']}")
-                self._set_model(CONFIG["DEFAULT_MODEL"])
-            
-            # Extract last AI reply
-            narrative = ""
-            options: List[str] = []
-            last_dm = self.state.conversation.rfind("Dungeon Master:")
-            if last_dm != -1:
-                raw_reply = self.state.conversation[last_dm + len("Dungeon Master:"):].strip()
-                reply_text = raw_reply.strip()
-                narrative, options = self._parse_ai_reply(raw_reply)
-                display_text = narrative if narrative else reply_text
-                self.state.last_ai_reply_raw = reply_text
-                self.state.last_ai_reply = display_text
-                self.state.last_options = list(options)
-            else:
-                self.state.last_ai_reply_raw = ""
-                self.state.last_ai_reply = ""
-                self.state.last_options = []
-            
-            self.state.adventure_started = True
-            print("Adventure loaded successfully!")
-            if self.state.last_ai_reply_raw:
-                spoken_text = narrative if narrative else None
-                self._display_ai_reply(self.state.last_ai_reply, self.state.last_options, spoken_text=spoken_text)
-            return True
-            
-        except Exception as e:
-            self.log_error("Error loading adventure", e)
-            print("Failed to load adventure.")
+        result = self.session.load()
+        if not result.ok:
+            print(result.error)
             return False
+        print("Adventure loaded successfully!")
+        if result.raw_reply:
+            self._display_ai_reply(result.narrative, result.options)
+        return True
 
     def select_genre_and_role(self) -> Tuple[str, str]:
         """Interactive genre and role selection"""
@@ -552,46 +3038,21 @@ Available commands:
     def start_new_adventure(self) -> bool:
         """Start a new adventure with character creation"""
         try:
-            self.state.selected_genre, self.state.selected_role = self.select_genre_and_role()
-            
-            self.state.character_name = input("\nEnter your character's name: ").strip() or "Alex"
-            
-            starter = ROLE_STARTERS[self.state.selected_genre].get(
-                self.state.selected_role, 
-                "You find yourself in an unexpected situation when"
-            )
-            
-            print(f"\n--- Adventure Start: {self.state.character_name} the {self.state.selected_role} ---")
-            print(f"Starting scenario: {starter}")
+            genre, role = self.select_genre_and_role()
+            # Generate the opening scene while the player types their name
+            self.session.prepare_opening(genre, role)
+
+            name = input("\nEnter your character's name: ").strip() or "Alex"
+
+            print(f"\n--- Adventure Start: {name} the {role} ---")
+            print(f"Starting scenario: {_get_starter(genre, role)}")
             print("Type '/?' or '/help' for commands.\n")
-            
-            # Initial setup
-            language_note = "Output Language: Chinese\n" if self.use_chinese else ""
-            initial_context = (
-                f"### Adventure Setting ###\n"
-                f"Genre: {self.state.selected_genre}\n"
-                f"Player Character: {self.state.character_name} the {self.state.selected_role}\n"
-                f"Starting Scenario: {starter}\n"
-                f"{language_note}\n"
-                "Dungeon Master: "
-            )
-            
-            self.state.conversation = initial_context
-            self.state.last_options = []
-            self.state.last_ai_reply = ""
-            self.state.last_ai_reply_raw = ""
-            
-            # Get first response
-            ai_reply = self.get_ai_response(self.state.conversation)
-            if ai_reply:
-                self.state.conversation += ai_reply
-                self._update_ai_reply(ai_reply)
-                self.state.adventure_started = True
-                return True
-            else:
-                print("Failed to get initial response from AI.")
-                return False
-                
+
+            result = self._run_turn(lambda on_event: self.session.new_game(genre, role, name, on_event))
+            if not result.ok:
+                print(result.error)
+            return result.ok
+
         except Exception as e:
             self.log_error("Error starting new adventure", e)
             return False
@@ -607,6 +3068,8 @@ Available commands:
             return False
         elif cmd == "/redo":
             self._handle_redo()
+        elif cmd == "/variants" or cmd.startswith("/variants "):
+            self._handle_variants(cmd[len("/variants"):].strip())
         elif cmd == "/save":
             self.save_adventure()
         elif cmd == "/load":
@@ -615,6 +3078,10 @@ Available commands:
             self._handle_model_change()
         elif cmd == "/status":
             self.show_status()
+        elif cmd == "/perf" or cmd.startswith("/perf "):
+            self._handle_perf(cmd[len("/perf"):].strip())
+        elif cmd == "/profile" or cmd.startswith("/profile "):
+            self._handle_profile(cmd[len("/profile"):].strip())
         else:
             print(f"Unknown command: {command}. Type '/help' for available commands.")
         
@@ -622,21 +3089,80 @@ Available commands:
 
     def _handle_redo(self) -> None:
         """Handle the /redo command"""
-        if self.state.last_ai_reply and self.state.last_player_input:
-            self.remove_last_ai_response()
-            full_prompt = (
-                f"{self.state.conversation}\n"
-                f"Player: {self.state.last_player_input}\n"
-                "Dungeon Master:"
-            )
-            new_reply = self.get_ai_response(full_prompt)
-            if new_reply:
-                self.state.conversation += f"\nPlayer: {self.state.last_player_input}\nDungeon Master: {new_reply}"
-                self._update_ai_reply(new_reply)
+        result = self._run_turn(self.session.redo)
+        if not result.ok:
+            print(result.error)
+
+    def _handle_variants(self, argument: str) -> None:
+        """Handle the /variants N command"""
+        try:
+            count = int(argument) if argument else 3
+        except ValueError:
+            print("Usage: /variants N")
+            return
+        if count < 1:
+            print("Usage: /variants N")
+            return
+
+        print(f"Generating {min(count, CONFIG['VARIANTS_MAX'])} variants...")
+        variants = self.session.generate_variants(count)
+        if not variants:
+            print("Failed to generate variants.")
+            return
+
+        for idx, variant in enumerate(variants, 1):
+            print(f"\n--- Variant {idx} ---")
+            print(variant.narrative)
+            for option_idx, option in enumerate(variant.options, 1):
+                print(f"  {option_idx}. {option}")
+
+        choice = input(f"\nPick a variant (1-{len(variants)}) or press Enter to keep the current reply: ").strip()
+        if not choice:
+            print("Kept the current reply.")
+            return
+        if not choice.isdigit() or not 1 <= int(choice) <= len(variants):
+            print("Invalid choice. Kept the current reply.")
+            return
+
+        result = self.session.commit_variant(variants[int(choice) - 1])
+        if not result.ok:
+            print(result.error)
+            return
+        self._display_ai_reply(result.narrative, result.options)
+
+    def _handle_perf(self, argument: str) -> None:
+        """Handle the /perf command"""
+        if argument in ("on", "off"):
+            self.perf.enabled = argument == "on"
+            print(f"Performance timing {'enabled' if self.perf.enabled else 'disabled'}.")
+            return
+        if argument:
+            print("Usage: /perf [on|off]")
+            return
+        if not self.perf.enabled and not self.perf.samples:
+            print("Performance timing is off. Use '/perf on' or start with --perf.")
+            return
+        print(f"\n--- Performance (last {self.perf.window} samples per stage) ---")
+        print(self.perf.report())
+        if self.perf.metrics_path:
+            print(f"Metrics file: {self.perf.metrics_path}")
+        print("---------------------------")
+
+    def _handle_profile(self, argument: str) -> None:
+        """Handle the /profile start|stop command"""
+        if argument == "start":
+            if self.profiler.active:
+                print(f"Already profiling to {self.profiler.report_path}")
+            else:
+                print(f"Profiling started. Per-turn reports go to {self.profiler.start()}")
+        elif argument == "stop":
+            stats_path = self.profiler.stop()
+            if stats_path is None:
+                print("Profiling is not running.")
             else:
-                print("Failed to generate new response.")
+                print(f"Profiling stopped. Report: {self.profiler.report_path}, stats: {stats_path}")
         else:
-            print("Nothing to redo.")
+            print("Usage: /profile start|stop")
 
     def _handle_model_change(self) -> None:
         """Handle model change command"""
@@ -647,29 +3173,27 @@ Available commands:
             print("Model unchanged.")
             return
         if self._set_model(new_model):
+            self.session.prewarm()
             print(f"Model changed to: {self.state.current_model}")
 
     def process_player_input(self, user_input: str) -> None:
         """Process regular player input"""
-        self.state.last_player_input = user_input
-        formatted_input = f"Player: {user_input}"
-        
-        prompt = (
-            f"{self.state.conversation}\n"
-            f"{formatted_input}\n"
-            "Dungeon Master:"
-        )
-        
-        ai_reply = self.get_ai_response(prompt)
-        if ai_reply:
-            self.state.conversation += f"\n{formatted_input}\nDungeon Master: {ai_reply}"
-            self._update_ai_reply(ai_reply)
-            
-            # Auto-save every 5 interactions
-            if self.state.conversation.count("Player:") % 5 == 0:
-                self.save_adventure()
+        self._play_turn(lambda on_event: self.session.act(user_input, on_event))
+
+    def _play_turn(self, engine_call: Callable[[Optional[Callable[[str, str], None]]], TurnResult]) -> None:
+        """Run a player turn and report its outcome"""
+        self.perf.begin_turn()
+        with self.perf.span("turn_total"):
+            result = self._run_turn(engine_call)
+        if not result.ok:
+            print(result.error)
         else:
-            print("Failed to get response from AI. Please try again.")
+            if result.autosave_failed:
+                print(f"The last autosave failed (see {CONFIG['LOG_FILE']}); use /save to try again.")
+            if result.autosaved:
+                print("Autosave queued.")
+        self.perf.end_turn(ok=result.ok, model=self.state.current_model)
+        self.profiler.turn_finished(result.action or "turn")
 
     def run(self) -> None:
         """Main game loop"""
@@ -678,9 +3202,15 @@ Available commands:
         if not self._validate_openai_credentials():
             return
 
-        selected_model = self.select_model()
+        router = self.session.router
+        if router is not None and not self.model_name:
+            # The router picks a model per turn; start from its first choice
+            selected_model = router.choose()[0]
+        else:
+            selected_model = self.model_name or self.select_model()
         if not self._set_model(selected_model):
             return
+        self.session.prewarm()
         print(f"Using model: {self.state.current_model}\n")
         
         # Load or start adventure
@@ -714,7 +3244,7 @@ Available commands:
                             print(f"（你选择了选项 {user_input}：{selected_action}）")
                         else:
                             print(f"(You selected option {user_input}: {selected_action})")
-                        self.process_player_input(selected_action)
+                        self._play_turn(lambda on_event: self.session.choose(option_index, on_event))
                         continue
                     if self.use_chinese:
                         print("无效的选项编号，请重新输入。")
@@ -730,16 +3260,83 @@ Available commands:
                 self.log_error("Unexpected error in game loop", e)
                 print("An unexpected error occurred. Check the log for details.")
 
+def bake_openings(model_name: str, count: int, use_chinese: bool = False,
+                  path: str = CONFIG["OPENINGS_FILE"], base_url: Optional[str] = CONFIG["BASE_URL"]) -> int:
+    """Pre-generate `count` opening scenes for every genre and role into the bundle file"""
+    if not (os.getenv("OPENAI_API_KEY") or base_url):
+        print("OpenAI API key not found. Please set the OPENAI_API_KEY environment variable.")
+        return 0
+
+    session = AdventureSession(use_chinese=use_chinese, model_name=model_name, base_url=base_url)
+    if not session.set_model(model_name):
+        print(f"Failed to initialize model '{model_name}'.")
+        return 0
+
+    bundle = OpeningBundle.load(path)
+    bundle.clear(session.language)
+    jobs = [(genre, role) for genre, roles in ROLE_STARTERS.items() for role in roles for _ in range(count)]
+    print(f"Baking {len(jobs)} opening scenes with {model_name}...")
+    with ThreadPoolExecutor(max_workers=CONFIG["BAKE_CONCURRENCY"]) as executor:
+        futures = {executor.submit(session.generate_opening, genre, role): (genre, role) for genre, role in jobs}
+        for done, future in enumerate(as_completed(futures), 1):
+            genre, role = futures[future]
+            ai_reply = future.result()
+            if ai_reply:
+                bundle.add(session.language, genre, role, ai_reply)
+            else:
+                print(f"Skipped an invalid opening for {genre} / {role}")
+            if done % 25 == 0 or done == len(jobs):
+                print(f"{done}/{len(jobs)} done")
+
+    bundle.save()
+    session.close()
+    baked = bundle.count(session.language)
+    print(f"Saved {baked} opening scenes to {path}")
+    return baked
+
 def main():
     """Main entry point with exception handling"""
     try:
         parser = argparse.ArgumentParser(description="AI Dungeon Master Adventure")
         parser.add_argument("--use-chinese", action="store_true", help="Render all Dungeon Master output in Simplified Chinese")
         parser.add_argument("--enable-tts", action="store_true", help="Enable text-to-speech narration using espeak-ng")
+        parser.add_argument("--stream", action="store_true", help="Print the Dungeon Master's narrative as it is generated")
+        parser.add_argument("--speculate", action="store_true", help="Pre-generate replies for the suggested actions while you read")
+        parser.add_argument("--model", help="OpenAI model to use instead of asking at startup")
+        parser.add_argument("--base-url", default=CONFIG["BASE_URL"], help="OpenAI-compatible endpoint to use, e.g. http://127.0.0.1:8000/v1 for fake_llm_server.py")
+        parser.add_argument("--fallback-model", default=CONFIG["FALLBACK_MODEL"], help="Model to use while the main model is failing")
+        parser.add_argument("--route", action="store_true", help="Send each turn to the fastest healthy model among the configured routes")
+        parser.add_argument("--hedge", action="store_true", help="Send a duplicate request when the first token is unusually late")
+        parser.add_argument("--perf", action="store_true", help="Time each stage of every turn (see /perf)")
+        parser.add_argument("--perf-file", metavar="PATH", help="Also append per-turn timings to this JSONL file (implies --perf)")
+        parser.add_argument("--profile", action="store_true", help=f"Profile CPU and memory for the whole session into {CONFIG['PROFILE_DIR']}/")
+        parser.add_argument("--redo-alternates", type=int, default=0, metavar="N", help="Prefetch N alternative replies per turn so /redo is instant")
+        parser.add_argument("--bake-openings", action="store_true", help=f"Pre-generate opening scenes for every genre and role into {CONFIG['OPENINGS_FILE']} and exit")
+        parser.add_argument("--bake-count", type=int, default=3, help="Opening scenes to bake per genre and role (default: 3)")
         args = parser.parse_args()
 
-        game = AdventureGame(use_chinese=args.use_chinese, enable_tts=args.enable_tts)
-        game.run()
+        if args.bake_openings:
+            bake_openings(args.model or CONFIG["DEFAULT_MODEL"], args.bake_count, use_chinese=args.use_chinese,
+                          base_url=args.base_url)
+            LLM_CLIENTS.close()
+            return
+
+        game = AdventureGame(use_chinese=args.use_chinese, enable_tts=args.enable_tts, stream_output=args.stream,
+                             speculate=args.speculate, model_name=args.model,
+                             redo_alternates=args.redo_alternates, hedge=args.hedge,
+                             fallback_model=args.fallback_model, route=args.route, base_url=args.base_url,
+                             perf=PerfRecorder(enabled=args.perf, metrics_path=args.perf_file))
+        if args.profile:
+            print(f"Profiling to {game.profiler.start()}")
+        try:
+            game.run()
+        finally:
+            stats_path = game.profiler.stop()
+            if stats_path:
+                print(f"Profile saved to {game.profiler.report_path} and {stats_path}")
+            game.speech.close()
+            game.session.close()
+            LLM_CLIENTS.close()
     except Exception as e:
         print(f"Fatal error: {e}")
         print("Check error_log.txt for details.")
@@ -0,0 +1,294 @@
+"""Unit tests for the engine pieces that are easiest to get subtly wrong.
+
+Run with: python -m pytest -q
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+
+import httpx
+import pytest
+from langchain_core.messages import AIMessageChunk
+
+import fake_llm_server
+import main
+from main import (CONFIG, AdventureSession, ContextBuilder, GameState, HedgedStreamer, LLMResilience,
+                  StreamingReplyParser, TurnRecord)
+
+# ===== StreamingReplyParser =====
+
+def _feed_in_pieces(text: str, sizes) -> list:
+    parser = StreamingReplyParser()
+    events = []
+    position = 0
+    for size in sizes:
+        events.extend(parser.feed(text[position:position + size]))
+        position += size
+    events.extend(parser.feed(text[position:]))
+    return events, parser
+
+def _collect(events) -> tuple:
+    narrative = "".join(text for kind, text in events if kind == "narrative")
+    options = [text for kind, text in events if kind == "option"]
+    return narrative, options
+
+def test_parser_single_characters_with_escapes_surrogates_and_cjk():
+    reply = {"narrative": "Tab\there, \"quoted\", café \U0001F600 你好世界",
+             "options": ["Go 北", "Say \"hi\"\\n", "Smile \U0001F642"]}
+    text = json.dumps(reply)  # ASCII escapes, so \\u surrogate pairs get split across chunks
+    events, parser = _feed_in_pieces(text, [1] * len(text))
+    assert _collect(events) == (reply["narrative"], reply["options"])
+    assert parser.close() == (reply["narrative"], reply["options"])
+
+def test_parser_random_chunking_matches_whole_reply():
+    reply = {"narrative": "老虎 \\ / é\U0001F600 end", "options": ["aé", "\U0001F642b"]}
+    for ensure_ascii in (True, False):
+        text = json.dumps(reply, ensure_ascii=ensure_ascii)
+        rng = random.Random(7)
+        for _ in range(50):
+            events, _ = _feed_in_pieces(text, [rng.randint(1, 6) for _ in range(len(text))])
+            assert _collect(events) == (reply["narrative"], reply["options"])
+
+def test_parser_ignores_nested_narrative_and_options_keys():
+    text = json.dumps({
+        "meta": {"narrative": "not this", "options": ["nor this"]},
+        "narrative": "The real scene.",
+        "options": ["Real option"],
+        "extra": [{"options": ["deep"]}]
+    })
+    events, _ = _feed_in_pieces(text, [3] * len(text))
+    assert _collect(events) == ("The real scene.", ["Real option"])
+
+def test_parser_falls_back_to_raw_text_for_prose():
+    parser = StreamingReplyParser()
+    assert parser.feed("Just some prose.") == []
+    assert parser.close()[0] == "Just some prose."
+
+# ===== ContextBuilder._fill_turns =====
+
+class WordCounter:
+    """One token per whitespace-separated word"""
+
+    def encoding_name(self, model_name: str) -> str:
+        return "words"
+
+    def count(self, text: str, model_name: str) -> int:
+        return len(text.split())
+
+def _state_with_turns(count: int) -> GameState:
+    # Each turn costs 1 + 10 words plus MESSAGE_OVERHEAD (4) per message = 19 tokens
+    return GameState(turns=[TurnRecord(action="go", raw_reply="", narrative="word " * 10) for _ in range(count)])
+
+def test_fill_turns_evicts_down_to_the_low_watermark_and_then_holds():
+    builder = ContextBuilder(counter=WordCounter(), total_budget=100, low_watermark=0.5)
+    state = _state_with_turns(10)
+    first_turn, used = builder._fill_turns(state, "model", 0)
+    assert (first_turn, used) == (8, 38)
+    assert state.context_start == 8
+
+    # Back under budget: the window start stays put so the prompt prefix is stable
+    state.turns.append(TurnRecord(action="go", raw_reply="", narrative="word " * 10))
+    assert builder._fill_turns(state, "model", 0) == (8, 57)
+
+def test_fill_turns_always_keeps_the_newest_turn():
+    builder = ContextBuilder(counter=WordCounter(), total_budget=10, low_watermark=0.5)
+    state = _state_with_turns(5)
+    first_turn, used = builder._fill_turns(state, "model", 0)
+    assert first_turn == 4
+    assert used == 19
+
+def test_turn_tokens_are_cached_per_encoding():
+    builder = ContextBuilder(counter=WordCounter())
+    turn = TurnRecord(action="go", raw_reply="", narrative="a b c")
+    assert builder.turn_tokens(turn, "model") == 12
+    turn.narrative = "longer text, but still cached"
+    assert builder.turn_tokens(turn, "model") == 12
+    turn.token_encoding = "other"
+    assert builder.turn_tokens(turn, "model") == 14
+
+# ===== LLMResilience =====
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setitem(CONFIG, "RETRY_BACKOFF_BASE", 0.001)
+    monkeypatch.setitem(CONFIG, "MAX_RETRIES", 2)
+    monkeypatch.setitem(CONFIG, "BREAKER_FAILURE_THRESHOLD", 3)
+
+def _resilience(fallback_model=None) -> LLMResilience:
+    return LLMResilience(lambda name: name, fallback_model=fallback_model)
+
+def _flaky(failures: int):
+    """A call that raises a transient error `failures` times, then answers with the model it got"""
+    calls = []
+
+    def _call(client, timeout):
+        calls.append(client)
+        if len(calls) <= failures:
+            raise httpx.ConnectError("connection refused")
+        return f"reply from {client}"
+    return _call, calls
+
+def test_retries_transient_errors_then_succeeds(fast_retries):
+    resilience = _resilience()
+    call, calls = _flaky(2)
+    assert resilience.run("primary", "primary", call) == "reply from primary"
+    assert len(calls) == 3
+    assert resilience.retries == 2
+    assert resilience.served_by() == "primary"
+    assert resilience.health["primary"].consecutive_failures == 0
+
+def test_retry_budget_limits_retries(fast_retries, monkeypatch):
+    monkeypatch.setitem(CONFIG, "RETRY_BUDGET_MIN_PER_MINUTE", 1)
+    monkeypatch.setitem(CONFIG, "RETRY_BUDGET_RATIO", 0.0)
+    resilience = _resilience()
+    call, calls = _flaky(10)
+    with pytest.raises(httpx.ConnectError):
+        resilience.run("primary", "primary", call)
+    # One try plus the single retry the budget allows
+    assert len(calls) == 2
+    assert resilience.retries == 1
+
+def test_non_retryable_errors_are_raised_without_recording():
+    resilience = _resilience()
+
+    def _call(client, timeout):
+        raise ValueError("bad request")
+    with pytest.raises(ValueError):
+        resilience.run("primary", "primary", _call)
+    assert resilience.health["primary"].requests == 0
+
+def test_retry_after_above_the_cap_moves_to_the_fallback(fast_retries):
+    resilience = _resilience(fallback_model="backup")
+    response = httpx.Response(429, headers={"retry-after": str(CONFIG["RETRY_BACKOFF_CAP"] * 4)},
+                              request=httpx.Request("POST", "http://test"))
+
+    def _call(client, timeout):
+        if client == "primary":
+            raise main.openai.RateLimitError("slow down", response=response, body=None)
+        return f"reply from {client}"
+    assert resilience.run("primary", "primary", _call) == "reply from backup"
+    assert resilience.retries == 0
+    assert resilience.served_by() == "backup"
+
+def test_breaker_opens_half_opens_and_closes(fast_retries, monkeypatch):
+    monkeypatch.setitem(CONFIG, "BREAKER_COOLDOWN", 0.05)
+    resilience = _resilience(fallback_model="backup")
+    failing, _ = _flaky(100)
+
+    with pytest.raises(httpx.ConnectError):
+        resilience.run("primary", "primary", lambda client, timeout: failing("primary", timeout))
+    health = resilience.health["primary"]
+    assert health.state == "open"
+    assert not resilience.available("primary")
+
+    # While open, calls skip straight to the fallback model
+    assert resilience.run("primary", "primary", lambda client, timeout: client) == "backup"
+    assert resilience.fallbacks >= 1
+
+    time.sleep(0.06)
+    assert resilience.available("primary")
+    assert health.state == "half-open"
+    # A failed trial call reopens the breaker at once
+    resilience.record_failure("primary")
+    assert health.state == "open"
+
+    time.sleep(0.06)
+    assert resilience.run("primary", "primary", lambda client, timeout: client) == "primary"
+    assert health.state == "closed"
+
+@pytest.fixture
+def fake_server():
+    server = fake_llm_server.start_server(fake_llm_server.FakeLLMConfig(ttft=0.0, tokens_per_sec=100000.0))
+    yield f"http://127.0.0.1:{server.server_address[1]}/v1"
+    server.shutdown()
+
+@pytest.mark.parametrize("stream", [False, True])
+def test_usage_is_credited_to_the_model_that_served_it(fake_server, tmp_path, monkeypatch, stream):
+    monkeypatch.chdir(tmp_path)
+    session = AdventureSession(model_name="primary", fallback_model="backup", base_url=fake_server)
+    try:
+        assert session.set_model("primary")
+        health = session.resilience._health("primary")
+        health.state, health.opened_at = "open", time.monotonic()
+        on_event = (lambda kind, text: None) if stream else None
+        assert session._request_reply("I look around.", on_event)
+        assert session._turn_route[0] == "backup"
+        assert list(session.usage.by_model) == ["backup"]
+    finally:
+        session.close()
+
+def test_async_turns_reject_empty_actions(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    session = AdventureSession()
+    session.state.turns = [TurnRecord(action="", raw_reply="{}", narrative="Opening")]
+
+    async def _play():
+        result = await session.step("   ")
+        events = [event async for event in session.stream_step("")]
+        return result, events
+    try:
+        result, events = asyncio.run(_play())
+    finally:
+        session.close()
+    assert (result.ok, result.error) == (False, "Empty action.")
+    assert events == [("reply", "")]
+    assert len(session.state.turns) == 1
+
+def test_failed_autosave_is_reported_once(tmp_path, monkeypatch):
+    monkeypatch.setitem(CONFIG, "LOG_FILE", str(tmp_path / "error_log.txt"))
+    # A directory cannot be opened for writing, so the background write fails
+    monkeypatch.setitem(CONFIG, "SAVE_FILE", str(tmp_path))
+    session = AdventureSession()
+    try:
+        assert session.autosave()
+        session._autosave.result(timeout=5)
+        assert session.autosave_failed()
+        assert not session.autosave_failed()
+    finally:
+        session.close()
+
+# ===== HedgedStreamer =====
+
+class FakeStreamingLLM:
+    """Streams a fixed reply; first_token_delays[i] delays the i-th request's first token"""
+
+    def __init__(self, first_token_delays):
+        self.first_token_delays = list(first_token_delays)
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def stream(self, messages, **kwargs):
+        with self._lock:
+            index = self.requests
+            self.requests += 1
+        time.sleep(self.first_token_delays[index])
+        for piece in (f"reply {index} ", "done"):
+            yield AIMessageChunk(content=piece)
+
+def _text(chunks) -> str:
+    return "".join(chunk.content for chunk in chunks)
+
+def test_hedge_fires_and_wins_when_the_first_token_is_late():
+    hedger = HedgedStreamer(initial_delay=0.05, max_per_minute=5)
+    llm = FakeStreamingLLM([2.0, 0.0])
+    started_at = time.monotonic()
+    assert _text(hedger.stream(llm, [])) == "reply 1 done"
+    assert time.monotonic() - started_at < 1.0
+    assert (hedger.stats.hedged, hedger.stats.hedge_wins) == (1, 1)
+
+def test_no_hedge_when_the_first_token_is_on_time():
+    hedger = HedgedStreamer(initial_delay=0.5, max_per_minute=5)
+    llm = FakeStreamingLLM([0.0])
+    assert _text(hedger.stream(llm, [])) == "reply 0 done"
+    assert hedger.stats.hedged == 0
+    assert llm.requests == 1
+
+def test_hedges_are_capped_per_minute():
+    hedger = HedgedStreamer(initial_delay=0.02, max_per_minute=1)
+    llm = FakeStreamingLLM([0.2, 0.0, 0.2])
+    assert _text(hedger.stream(llm, [])) == "reply 1 done"
+    # The cap is spent, so the late primary is waited for instead of hedged
+    assert _text(hedger.stream(llm, [])) == "reply 2 done"
+    assert (hedger.stats.hedged, hedger.stats.capped) == (1, 1)